@@ -0,0 +1,78 @@
+from IPython.display import display, HTML
+
+# OpenAD
+from openad.app.global_var_lib import GLOBAL_SETTINGS
+
+# OpenAD tools
+from openad_tools.output import output_text, output_error
+
+# Plugin
+from openad_plugin_rxn.plugin_master_class import canonicalize_smiles
+from openad_plugin_rxn.commands.predict_retro.predict_retro import PredictRetro
+
+
+class CacheRoutes(PredictRetro):
+    """
+    Display the cached sub-routes that lead to a molecule, taken from earlier retrosynthesis results.
+    """
+
+    def run(self):
+        """
+        Run the command.
+        """
+
+        # Parse input SMILES
+        self.input_smiles = self.cmd.get("smiles", [None])[0]
+        smiles_key = canonicalize_smiles(self.input_smiles) if self.input_smiles else None
+        if not smiles_key:
+            output_error(["Provided SMILES is invalid", f"Input SMILES: '{self.input_smiles}'"], return_val=False)
+            return
+
+        # Collect the sub-routes of every model, best first
+        known_subroutes = self.retrieve_result_cache_variants(self.subroutes_cache_prefix, [smiles_key])
+        subroutes = []
+        for name, _subroutes in known_subroutes.get(smiles_key, {}).items():
+            ai_model = name[len(self.subroutes_cache_prefix) :]
+            subroutes.extend({"ai_model": ai_model, **subroute} for subroute in _subroutes)
+        subroutes.sort(key=lambda x: x.get("confidence") or 0, reverse=True)
+
+        # Return data for API
+        if GLOBAL_SETTINGS["display"] == "api":
+            return subroutes
+
+        if not subroutes:
+            output_text(
+                "No known sub-routes for this molecule\n"
+                "<soft>Sub-routes are collected from the results of <cmd>rxn predict retrosynthesis</cmd></soft>",
+                return_val=False,
+            )
+            return
+
+        self._display_subroutes(subroutes)
+
+    def _display_subroutes(self, subroutes: list):
+        """
+        Print every sub-route with the model, target and parameters that produced it.
+        """
+        output = []
+        for i, subroute in enumerate(subroutes):
+            params = " ".join(f"{key}={val}" for key, val in subroute.get("params", {}).items() if val is not None)
+            if "rich_output" in self.cmd:
+                subroute_print_str = self._get_rich_print_str_reaction_tree([subroute["tree"]])
+            else:
+                subroute_print_str = self._get_basic_print_str_reaction_list(subroute["tree"])
+            output.append("")
+            output.append(f"<h1>Sub-route #{i + 1}</h1>")
+            output.append(f"<soft>AI model: {subroute.get('ai_model')}</soft>")
+            output.append(f"<soft>Part of the route for: {subroute.get('target')}</soft>")
+            if params:
+                output.append(f"<soft>Parameters: {params}</soft>")
+            output.append(subroute_print_str)
+
+        # Print - Jupyter Notebook
+        if GLOBAL_SETTINGS["display"] == "notebook":
+            display(HTML("<br>".join(output)))
+
+        # Print - CLI
+        else:
+            output_text("\n".join(output), return_val=False)
@@ -0,0 +1,74 @@
+import pandas as pd
+
+# OpenAD
+from openad.app.global_var_lib import GLOBAL_SETTINGS
+
+# OpenAD tools
+from openad_tools.output import output_table, output_error, output_text
+
+# Plugin
+from openad_plugin_rxn.plugin_master_class import RXNPlugin
+from openad_plugin_rxn.plugin_cache import memory_cache
+
+
+class CacheStats(RXNPlugin):
+    """
+    Display what's stored in the cache and how often it's used.
+    """
+
+    def __init__(self, cmd_pointer, cmd: dict):
+        """
+        Parameters
+        ----------
+        cmd_pointer:
+            The command pointer object
+        cmd: dict
+            Parser inputs from pyparsing as a dictionary
+        """
+        super().__init__(cmd_pointer)
+        self.cmd = cmd
+
+    def run(self):
+        """
+        Run the command.
+        """
+
+        # Load statistics
+        try:
+            all_stats = self._get_cache().stats()
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            output_error(["Unable to load cache statistics", err], return_val=False)
+            return
+
+        # Convert to DataFrame
+        df = pd.DataFrame(all_stats)
+        if df.empty:
+            output_text("The cache is empty", return_val=False)
+            return df if GLOBAL_SETTINGS["display"] == "api" else None
+        df.insert(4, "MB", (df.pop("bytes") / 1024 / 1024).round(2))
+        df["hit_rate"] = df["hit_rate"].apply(lambda x: "-" if pd.isna(x) else f"{round(x * 100)}%")
+        df = df.rename(
+            columns={
+                "function": "Function",
+                "ai_model": "AI model",
+                "entries": "Entries",
+                "hits": "Hits",
+                "misses": "Misses",
+                "hit_rate": "Hit rate",
+            }
+        )
+
+        # Return data for API
+        if GLOBAL_SETTINGS["display"] == "api":
+            return df
+
+        # Display results in CLI & Notebook
+        output_table(df, return_val=False)
+        mem_stats = memory_cache.stats()
+        mem_hit_rate = "-" if mem_stats["hit_rate"] is None else f"{round(mem_stats['hit_rate'] * 100)}%"
+        output_text(
+            f"<soft>Memory cache: {mem_stats['entries']} entries, "
+            f"{round(mem_stats['bytes'] / 1024 / 1024, 2)} MB, hit rate {mem_hit_rate}</soft>",
+            pad=1,
+            return_val=False,
+        )
@@ -0,0 +1,361 @@
+from time import sleep, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# OpenAD
+from openad.app.global_var_lib import GLOBAL_SETTINGS
+
+# OpenAD tools
+from openad_tools.spinner import spinner
+from openad_tools.output import output_error, output_success, output_warning
+
+# Plugin
+from openad_plugin_rxn.plugin_msg import msg
+from openad_plugin_rxn.plugin_params import CACHE_SETTINGS
+from openad_plugin_rxn.plugin_master_class import RXNPlugin, canonicalize_smiles
+from openad_plugin_rxn.plugin_retry import AdaptivePoller
+from openad_plugin_rxn.commands.predict_reactions.predict_reactions import PredictReactions
+from openad_plugin_rxn.commands.predict_retro.predict_retro import PredictRetro
+
+
+class CacheWarm(RXNPlugin):
+    """
+    Fill the cache with the predictions for a list of reactions or retrosynthesis targets.
+
+    Only inputs that are not cached yet are submitted, so the command can be
+    interrupted and run again. Jobs are submitted and polled in worker threads,
+    while the results are stored in the cache from the main thread.
+
+    Consumes a pyparsing dictionary with either:
+    { 'warm_reactions': 'reactions', 'from_file': 'my_reactions.csv' }
+    { 'warm_retro': 'retrosynthesis', 'from_df': 'my_molecules' }
+    """
+
+    cmd_pointer = None
+    cmd = None
+
+    # Polling, checks slow down from the first to the second interval
+    # Retrosynthesis jobs are timed on similar jobs instead, see AdaptivePoller
+    reactions_poll_seconds = (1, 8)
+    reactions_timeout_seconds = 300
+
+    # Summary
+    counts = {}
+
+    def __init__(self, cmd_pointer, cmd: dict):
+        """
+        Parameters
+        ----------
+        cmd_pointer:
+            The command pointer object
+        cmd: dict
+            Parser inputs from pyparsing as a dictionary
+        """
+        super().__init__(cmd_pointer)
+        self.cmd = cmd
+
+    def run(self):
+        """
+        Run the command.
+        """
+
+        # In case you're offline
+        if not self.api:
+            output_error(msg("err_api_offline"), return_val=False)
+            return
+
+        self.counts = {"total": 0, "cached": 0, "added": 0, "invalid": 0, "rejected": 0, "failed": 0}
+        if self.cmd.get("warm_retro"):
+            success = self._warm_retro()
+        else:
+            success = self._warm_reactions()
+        self.flush_writes()
+        if not success:
+            return
+
+        # Return data in API mode
+        if GLOBAL_SETTINGS["display"] == "api":
+            return self.counts
+
+        output_success(
+            [
+                f"Cache warmed: {self.counts['added']} of {self.counts['total']} results added",
+                f"<soft>Already cached: {self.counts['cached']}</soft>",
+                f"<soft>Invalid: {self.counts['invalid']}</soft>",
+                f"<soft>Rejected by RXN: {self.counts['rejected']}</soft>",
+                f"<soft>Failed: {self.counts['failed']}</soft>",
+            ],
+            return_val=False,
+        )
+
+    # Reactions
+    # ---------
+
+    def _warm_reactions(self):
+        """
+        Predict the reactions that are not cached yet, in batches of warm_batch_size reactions.
+        """
+        predictor = PredictReactions(self.cmd_pointer, {**self.cmd, "use_cache": True})
+        if not predictor._setup():
+            return False
+
+        reactions = list(dict.fromkeys(predictor.reactions_list))
+        missing = [
+            reaction
+            for reaction in reactions
+            if reaction not in predictor.invalid_reactions and reaction not in predictor.cached_reactions
+        ]
+        self.counts["total"] = len(reactions)
+        self.counts["invalid"] = len(predictor.invalid_reactions)
+        self.counts["cached"] = len(predictor.cached_reactions)
+
+        batch_size = max(1, CACHE_SETTINGS["warm_batch_size"])
+        batches = [missing[i : i + batch_size] for i in range(0, len(missing), batch_size)]
+
+        def _on_result(batch, predictions):
+            for reaction, prediction in zip(batch, predictions):
+                if prediction:
+                    predictor._store_prediction(reaction, prediction)
+                    self.counts["added"] += 1
+                else:
+                    self.counts["failed"] += 1
+
+        def _on_error(batch, _err):
+            self.counts["failed"] += len(batch)
+
+        return self._run_jobs(
+            "Predicting reactions",
+            {tuple(batch): (self._predict_reactions_batch, predictor, batch) for batch in batches},
+            lambda batch, predictions: _on_result(list(batch), predictions),
+            _on_error,
+            unit_count=len,
+        )
+
+    def _predict_reactions_batch(self, predictor: PredictReactions, batch: list) -> list:
+        """
+        Submit a batch of reactions and wait for the predictions.
+
+        Runs in a worker thread: it only talks to the API, it doesn't touch the cache or the display.
+        """
+        ai_model = predictor.using_params.get("ai_model")
+        topn = predictor._get_topn()
+        if topn:
+            reactions = [r.split(".") for r in batch]
+            response = self.retry_policy.call(self.api.predict_reaction_batch_topn, reactions, topn, ai_model)
+        else:
+            response = self.retry_policy.call(self.api.predict_reaction_batch, batch, ai_model)
+        task_id = (response or {}).get("task_id")
+        if not task_id:
+            raise ValueError(["The server failed to provide a task ID", response])
+
+        deadline = time() + self.reactions_timeout_seconds
+        polls = 0
+        while time() < deadline:
+            polls += 1
+            sleep(self.retry_policy.poll_delay(polls, *self.reactions_poll_seconds))
+            if topn:
+                response = self.api.get_predict_reaction_batch_topn_results(task_id)
+            else:
+                response = self.api.get_predict_reaction_batch_results(task_id)
+            if not response or response.get("task_status") == "RUNNING":
+                continue
+            if response.get("predictions"):
+                return response.get("predictions")
+            if response.get("response", {}).get("payload", {}).get("task", {}).get("status") == "ERROR":
+                raise ValueError(["RXN API error", response])
+        raise TimeoutError(f"No predictions after {self.reactions_timeout_seconds} seconds")
+
+    # Retrosynthesis
+    # --------------
+
+    def _warm_retro(self):
+        """
+        Run a retrosynthesis for every target that is not cached or rejected yet.
+        """
+        predictor = PredictRetro(self.cmd_pointer, self.cmd)
+        predictor.using_params = self.parse_using_params(self.cmd, predictor.using_params_defaults)
+
+        targets = self._parse_targets_list()
+        if not targets:
+            return False
+
+        # Deduplicate by canonical SMILES, and set aside invalid targets
+        targets_by_key = {}
+        for smiles in targets:
+            key = canonicalize_smiles(smiles)
+            if key is None or len(smiles.split(".")) > 1:
+                self.counts["invalid"] += 1
+                continue
+            targets_by_key.setdefault(key, smiles)
+        self.counts["total"] = len(targets_by_key) + self.counts["invalid"]
+
+        # Skip targets that are cached or were rejected with the same parameters
+        keys = list(targets_by_key)
+        cached = self.retrieve_result_cache_many(name=predictor._get_cache_name(), keys=keys)
+        rejected = self.retrieve_result_cache_many(name=predictor._get_cache_name(rejected=True), keys=keys)
+        self.counts["cached"] = len(cached)
+        self.counts["rejected"] = len([key for key in rejected if key not in cached])
+        missing = [key for key in keys if key not in cached and key not in rejected]
+
+        seed_ai_model = predictor._get_seed_ai_model()
+        job_params = predictor._get_job_params()
+        history = self.get_job_durations("predict-retro", job_params)
+
+        def _on_result(key, result):
+            status, value, duration = result
+            if status == "rejected":
+                predictor._store_rejection(key, value)
+                self.counts["rejected"] += 1
+                return
+            self.record_job_duration("predict-retro", job_params, duration)
+            reactions_dict_list = predictor._simplify_results(value)
+            if not reactions_dict_list:
+                self.counts["failed"] += 1
+                return
+            predictor._store_result(key, value, reactions_dict_list)
+            if seed_ai_model:
+                predictor._seed_reaction_cache(seed_ai_model, key, reactions_dict_list)
+            self.counts["added"] += 1
+
+        def _on_error(_key, _err):
+            self.counts["failed"] += 1
+
+        return self._run_jobs(
+            "Running retrosynthesis",
+            {key: (self._predict_retro_target, predictor, targets_by_key[key], history) for key in missing},
+            _on_result,
+            _on_error,
+        )
+
+    def _predict_retro_target(self, predictor: PredictRetro, smiles: str, history: list) -> tuple:
+        """
+        Submit a retrosynthesis job and wait for the result, checks are timed on the history of similar jobs.
+
+        Runs in a worker thread: it only talks to the API, it doesn't touch the cache or the display.
+
+        Returns
+        -------
+        ('ok', retrosynthetic_paths, duration) or ('rejected', rxn_error_msg, None)
+        """
+        poller = AdaptivePoller(history)
+        response = self.retry_policy.call(
+            self.api.predict_automatic_retrosynthesis, smiles, **predictor._get_api_params()
+        )
+        payload = (response or {}).get("response", {}).get("payload") or {}
+        if payload.get("errorMessage"):
+            return "rejected", payload.get("errorMessage"), None
+        task_id = response.get("prediction_id")
+        if not task_id:
+            raise ValueError(["The server failed to provide a prediction ID", response])
+
+        while not poller.expired():
+            sleep(poller.next_delay())
+            response = self.api.get_predict_automatic_retrosynthesis_results(task_id)
+            if response and response.get("status") == "SUCCESS":
+                retrosynthetic_paths = response.get("retrosynthetic_paths")
+                if not retrosynthetic_paths:
+                    raise ValueError("No retrosynthetic paths found")
+                return "ok", retrosynthetic_paths, poller.elapsed()
+        raise TimeoutError(f"No result after {round(poller.elapsed())} seconds")
+
+    def _parse_targets_list(self):
+        """
+        Parse the list of retrosynthesis targets from the 'smiles' column of
+        a CSV file or dataframe, or from the lines of a TXT file.
+        """
+        # From file
+        if self.cmd.get("from_file"):
+            from_file = self.cmd.get("from_file")
+            ext = from_file.split(".")[-1]
+
+            # CSV file
+            if ext == "csv":
+                targets_df = self.get_dataframe_from_file(from_file)
+                if targets_df is None:
+                    return []
+                targets = self.get_column_as_list_from_dataframe(targets_df, "smiles")
+                if not targets:
+                    output_error(
+                        "No molecules found in CSV file. Molecules should be stored in a column named 'SMILES'",
+                        return_val=False,
+                    )
+                return targets or []
+
+            # TXT file
+            elif ext == "txt":
+                targets = self.get_list_from_txt_file(from_file)
+                if not targets:
+                    output_error("No molecules found in TXT file, file seems to be empty", return_val=False)
+                return targets or []
+
+            # Invalid file format
+            else:
+                output_error(["Invalid file format", "Accepted formats are .csv or .txt"], return_val=False)
+                return []
+
+        # From dataframe
+        elif self.cmd.get("from_df"):
+            targets_df = self.cmd_pointer.get_df(self.cmd["from_df"])
+            if targets_df is None:
+                return []
+            targets = self.get_column_as_list_from_dataframe(targets_df, "smiles")
+            if not targets:
+                output_error(["No molecules found", "Dataframe should have a 'smiles' column"], return_val=False)
+            return targets or []
+
+        return []
+
+    # Jobs
+    # ----
+
+    def _run_jobs(self, label: str, jobs: dict, on_result, on_error, unit_count=None):
+        """
+        Run jobs in a pool of warm_concurrency worker threads and hand
+        their results to the callbacks as they complete, in the main thread.
+
+        Parameters
+        ----------
+        label: str
+            Progress message.
+        jobs: dict
+            {job_key: (function, *args)}
+        on_result: callable
+            on_result(job_key, result)
+        on_error: callable
+            on_error(job_key, err)
+        unit_count: callable, optional
+            Number of inputs covered by a job key, defaults to 1.
+        """
+        total = sum(unit_count(key) if unit_count else 1 for key in jobs)
+        if not total:
+            return True
+        if not self.wait_for_project():
+            return False
+
+        done = 0
+        errors = []
+        spinner.start(f"{label} - 0/{total}")
+        executor = ThreadPoolExecutor(max_workers=max(1, CACHE_SETTINGS["warm_concurrency"]))
+        try:
+            futures = {executor.submit(job[0], *job[1:]): key for key, job in jobs.items()}
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    on_result(key, future.result())
+                except Exception as err:  # pylint: disable=broad-exception-caught
+                    on_error(key, err)
+                    errors.append(err)
+                done += unit_count(key) if unit_count else 1
+                spinner.start(f"{label} - {done}/{total}")
+
+        # Results that came in so far are cached, so running the command again picks up where it stopped
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            spinner.stop()
+            output_warning(f"Interrupted after {done}/{total}, run the command again to continue", return_val=False)
+            return False
+
+        executor.shutdown(wait=True)
+        spinner.succeed(f"{label} - {done}/{total}")
+        if errors:
+            output_warning([f"{len(errors)} job{'' if len(errors) == 1 else 's'} failed", errors[0]], return_val=False)
+        return True
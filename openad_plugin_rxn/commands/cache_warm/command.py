@@ -0,0 +1,70 @@
+import os
+import pyparsing as py
+
+# OpenAD
+from openad.core.help import help_dict_create_v2
+
+# OpenAD tools
+from openad_tools.grammar_def import str_quoted, str_strict_or_quoted, clause_using
+
+# Plugin
+from openad_plugin_rxn.plugin_grammar_def import cache, warm, reaction_s, retrosynthesis, f_rom
+from openad_plugin_rxn.plugin_params import PLUGIN_NAME, PLUGIN_KEY, PLUGIN_NAMESPACE
+from openad_plugin_rxn.commands.cache_warm.cache_warm import CacheWarm
+
+
+class PluginCommand:
+    """Warm up cache"""
+
+    category: str  # Category of command
+    index: int  # Order in help
+    name: str  # Name of command = command dir name
+    parser_id: str  # Internal unique identifier
+
+    def __init__(self):
+        self.category = "System"
+        self.index = 6
+        self.name = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+        self.parser_id = f"plugin_{PLUGIN_KEY}_{self.name}"
+
+    def add_grammar(self, statements: list, grammar_help: list):
+        """Create the command definition & documentation"""
+
+        # Command definition
+        statements.append(
+            py.Forward(
+                py.CaselessKeyword(PLUGIN_NAMESPACE)
+                + cache
+                + warm
+                + (reaction_s("warm_reactions") | retrosynthesis("warm_retro"))
+                + f_rom
+                + (
+                    (py.Suppress("file") + str_quoted("from_file"))
+                    | (py.Suppress("dataframe") + str_strict_or_quoted("from_df"))
+                )
+                + clause_using
+            )(self.parser_id)
+        )
+
+        # Command help
+        clauses = "[ USING (<parameter>=<value> <parameter>=<value>) ]"
+        grammar_help.append(
+            help_dict_create_v2(
+                plugin_name=PLUGIN_NAME,
+                plugin_namespace=PLUGIN_NAMESPACE,
+                category=self.category,
+                command=[
+                    f"{PLUGIN_NAMESPACE} cache warm reactions from file '<filename.csv>' {clauses}",
+                    f"{PLUGIN_NAMESPACE} cache warm reactions from dataframe <dataframe_name> {clauses}",
+                    f"{PLUGIN_NAMESPACE} cache warm retrosynthesis from file '<filename.csv>' {clauses}",
+                    f"{PLUGIN_NAMESPACE} cache warm retrosynthesis from dataframe <dataframe_name> {clauses}",
+                ],
+                description_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), "description.txt"),
+            )
+        )
+
+    def exec_command(self, cmd_pointer, parser):
+        """Execute the command"""
+        cmd = parser.as_dict()
+        cache_warm = CacheWarm(cmd_pointer, cmd)
+        return cache_warm.run()
@@ -4,6 +4,9 @@ import pyparsing as py
 # OpenAD
 from openad.core.help import help_dict_create_v2
 
+# OpenAD tools
+from openad_tools.grammar_def import clause_using
+
 # Plugin
 from openad_plugin_rxn.plugin_grammar_def import clear, cache
 from openad_plugin_rxn.plugin_params import PLUGIN_NAME, PLUGIN_KEY, PLUGIN_NAMESPACE
@@ -18,6 +21,14 @@ class PluginCommand:
     name: str  # Name of command = command dir name
     parser_id: str  # Internal unique identifier
 
+    # Filters for selective clearing
+    using_params_defaults = {
+        "function": None,
+        "ai_model": None,
+        "older_than_days": None,
+        "smiles": None,
+    }
+
     def __init__(self):
         self.category = "System"
         self.index = 0
@@ -28,7 +39,9 @@ class PluginCommand:
         """Create the command definition & documentation"""
 
         # Command definition
-        statements.append(py.Forward(py.CaselessKeyword(PLUGIN_NAMESPACE) + clear + cache)(self.parser_id))
+        statements.append(
+            py.Forward(py.CaselessKeyword(PLUGIN_NAMESPACE) + clear + cache + clause_using)(self.parser_id)
+        )
 
         # Command help
         grammar_help.append(
@@ -36,12 +49,14 @@ class PluginCommand:
                 plugin_name=PLUGIN_NAME,
                 plugin_namespace=PLUGIN_NAMESPACE,
                 category=self.category,
-                command=f"{PLUGIN_NAMESPACE} clear cache",
+                command=f"{PLUGIN_NAMESPACE} clear cache [ USING (<parameter>=<value> <parameter>=<value>) ]",
                 description_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), "description.txt"),
             )
         )
 
     def exec_command(self, cmd_pointer, parser):
         """Execute the command"""
+        cmd = parser.as_dict()
         rxn_plugin = RXNPlugin(cmd_pointer)
-        rxn_plugin.clear_cache()
+        filters = rxn_plugin.parse_using_params(cmd, self.using_params_defaults)
+        rxn_plugin.clear_cache(filters)
@@ -36,6 +36,9 @@ class InterpretRecipe(RXNPlugin):
             output_error(msg("err_api_offline"), return_val=False)
             return
 
+        if not self.wait_for_project():
+            return
+
         recipe = self.cmd["recipe"]
         recipe_file_path = self.cmd_pointer.workspace_path() + "/" + recipe.strip()
         is_file = os.path.isfile(recipe_file_path)
@@ -56,7 +59,7 @@ class InterpretRecipe(RXNPlugin):
         try:
             # raise Exception('This is a test error')
             recipe_steps = []
-            actios_from_procedure_results = self.api.paragraph_to_actions(recipe)
+            actios_from_procedure_results = self.retry_policy.call(self.api.paragraph_to_actions, recipe)
             if not actios_from_procedure_results["actions"]:
                 raise ValueError("No actions found in the provided paragraph")
             recipe_steps.append("<h1>Recipe steps:</h1>")
@@ -33,9 +33,12 @@ class ListModels(RXNPlugin):
         Run the command.
         """
 
+        if not self.wait_for_project():
+            return
+
         # Load models
         try:
-            all_models = self.api.list_models()
+            all_models = self.retry_policy.call(self.api.list_models)
             # raise Exception('This is a test error')
         except Exception as err:  # pylint: disable=broad-exception-caught
             output_error(["Unable to load models", err], return_val=False)
@@ -4,8 +4,7 @@ from IPython.display import display, HTML
 
 # OpenAD
 from openad.app.global_var_lib import GLOBAL_SETTINGS
-from openad.smols.smol_functions import valid_smiles
-from openad.smols.smol_cache import create_analysis_record, save_result
+from openad.smols.smol_cache import create_analysis_record
 
 # OpenAD tools
 from openad_tools.spinner import spinner
@@ -16,7 +15,7 @@ from openad_tools.jupyter import save_df_as_csv
 # Plugin
 from openad_plugin_rxn.plugin_msg import msg
 from openad_plugin_rxn.plugin_params import PLUGIN_KEY
-from openad_plugin_rxn.plugin_master_class import RXNPlugin
+from openad_plugin_rxn.plugin_master_class import RXNPlugin, canonicalize_smiles
 
 
 class PredictReactions(RXNPlugin):
@@ -42,6 +41,8 @@ class PredictReactions(RXNPlugin):
 
     # API
     api = None
+    poll_base_seconds = 1  # Check on the job every second at first, slowing down to poll_cap_seconds
+    poll_cap_seconds = 4
 
     # Command
     reactions_list = []
@@ -52,6 +53,7 @@ class PredictReactions(RXNPlugin):
     cached_reactions = {}
     invalid_reactions = {}
     skip_count = 0  # Number of cached or invalid reactions that can be skipped
+    invalid_smiles_cache_name = "rejected-invalid-smiles"  # Negative cache, see RXNCache
     reactions_list_sanitized = []  # Reactions list without invalid or cached reactions
 
     # Default parameters
@@ -178,28 +180,8 @@ class PredictReactions(RXNPlugin):
             prediction = self.reaction_predictions[i]
 
             # Save result in cache
-            # - - -
-            # RXN returns canonicalized smiles, so we create two cache records:
-            # one with the input smiles and one with the rxn-canonicalized smiles as key.
-            # - - -
-            # 1) Input smiles
+            self._store_prediction(reaction, prediction)
             input_smiles = reaction.split(".")
-            input_smiles_key = self.homogenize_smiles(input_smiles)
-            topn = self.using_params.get("topn") or self._get_backward_compatible_topn()
-            topn_str = "" if topn in [None, 0, "0"] else f"-topn-{topn}"
-            self.store_result_cache(
-                name=f"predict-reaction-{self.using_params.get('ai_model')}{topn_str}",
-                key=input_smiles_key,
-                payload=prediction,
-            )
-            # 2) Canonicalized smiles from RXN
-            prediction_smiles = prediction.get("smiles", "").split(">>")[0].split(".")
-            prediction_smiles_key = self.homogenize_smiles(prediction_smiles)
-            self.store_result_cache(
-                name=f"predict-reaction-{self.using_params.get('ai_model')}{topn_str}",
-                key=prediction_smiles_key,
-                payload=prediction,
-            )
 
             # Save results as analysis records that can be merged
             # with the molecule working set in a follow up comand:
@@ -208,7 +190,7 @@ class PredictReactions(RXNPlugin):
             output_smiles = [output_smiles[1]] if len(output_smiles) > 1 else []
             all_smiles = input_smiles + output_smiles
             for smiles in all_smiles:
-                save_result(
+                self.save_analysis_record(
                     create_analysis_record(
                         smiles=smiles,
                         toolkit=PLUGIN_KEY,
@@ -218,8 +200,7 @@ class PredictReactions(RXNPlugin):
                             "sources": input_smiles,
                             "result": output_smiles,
                         },
-                    ),
-                    self.cmd_pointer,
+                    )
                 )
 
             # PRINT REACTION - NEWLY GENERATED REACTIONS
@@ -230,6 +211,9 @@ class PredictReactions(RXNPlugin):
             )
             self._display_reaction(index, reaction, prediction)
 
+        # Results are written to disk in the background
+        self.flush_writes()
+
         # Convert to DataFrame
         df = pd.DataFrame.from_dict(self.output_data)
         df = df.fillna("")  # Replace NaN with empty string
@@ -327,34 +311,78 @@ class PredictReactions(RXNPlugin):
         invalid_reactions = {}
         cached_reactions = {}
 
+        # SMILES that failed to parse, see the negative cache below
+        all_invalid_smiles = {}
+
         # Loop
+        cache_keys = {}
         for reaction in self.reactions_list:
-            # Check for invalid SMILES
-            input_smiles = reaction.split(".")
+            # Check for invalid SMILES, empty components are ignored, eg. CCO..BrBr
+            # Note: canonicalize_smiles is memoized, so building
+            # the cache keys below won't parse the SMILES again
+            input_smiles = [smiles for smiles in reaction.split(".") if smiles]
             invalid_smiles = []
             for smiles in input_smiles:
-                if not valid_smiles(smiles):
+                if canonicalize_smiles(smiles) is None:
                     invalid_smiles.append(smiles)
+                    all_invalid_smiles[smiles] = {"message": "Invalid SMILES"}
 
             # REACTION IS INVALID
             if len(invalid_smiles) > 0:
                 invalid_reactions[reaction] = invalid_smiles
                 continue
 
-            # Check for cached results
+            # Collect cache keys so we can look them up in one go
+            # - - -
+            # Results cached by older versions of the plugin are
+            # stored under the sorted but non-canonicalized SMILES.
             elif self.use_cache:
-                input_smiles_key = self.homogenize_smiles(input_smiles)
-                topn = self.using_params.get("topn") or self._get_backward_compatible_topn()
-                topn_str = "" if topn in [None, 0, "0"] else f"-topn-{topn}"
-                result_from_cache = self.retrieve_result_cache(
-                    name=f"predict-reaction-{self.using_params.get('ai_model')}{topn_str}",
-                    key=input_smiles_key,
+                cache_keys[reaction] = list(
+                    dict.fromkeys(
+                        [
+                            self.homogenize_smiles(input_smiles),
+                            self.homogenize_smiles(reaction.split("."), canonical=False),
+                        ]
+                    )
                 )
 
-                # REACTION IS CACHED
+        # Check for cached results
+        if cache_keys:
+            all_keys = [key for keys in cache_keys.values() for key in keys]
+            results_from_cache = self.retrieve_result_cache_many(
+                name=self._get_cache_name(),
+                keys=all_keys,
+            )
+
+            # Topn results can be served from any cached result with a higher topn
+            topn = self._get_topn()
+            if topn:
+                missing_keys = [key for key in all_keys if not results_from_cache.get(key)]
+                if missing_keys:
+                    results_from_cache.update(self._retrieve_topn_result_cache_many(missing_keys, topn))
+
+            # REACTION IS CACHED
+            for reaction, keys in cache_keys.items():
+                result_from_cache = next((results_from_cache[key] for key in keys if results_from_cache.get(key)), None)
                 if result_from_cache:
                     cached_reactions[reaction] = result_from_cache
-                    continue
+
+            # Count hits & misses for rxn cache stats
+            self.record_cache_lookups(
+                self._get_cache_name(), len(cached_reactions), len(cache_keys) - len(cached_reactions)
+            )
+
+        # Remember invalid SMILES, only the ones that failed to parse are looked up,
+        # so valid input doesn't pay for a database query. Known ones keep their expiry.
+        if all_invalid_smiles:
+            known_invalid_smiles = self.retrieve_result_cache_many(
+                name=self.invalid_smiles_cache_name, keys=list(all_invalid_smiles)
+            )
+            new_invalid_smiles = {
+                smiles: payload for smiles, payload in all_invalid_smiles.items() if smiles not in known_invalid_smiles
+            }
+            if new_invalid_smiles:
+                self.store_result_cache_many(name=self.invalid_smiles_cache_name, payloads=new_invalid_smiles)
 
         return {
             "invalid_reactions": invalid_reactions,
@@ -362,10 +390,85 @@ class PredictReactions(RXNPlugin):
             "count": len(invalid_reactions.keys()) + len(cached_reactions.keys()),
         }
 
+    def _store_prediction(self, reaction: str, prediction: dict):
+        """
+        Save a new prediction in the cache.
+
+        RXN returns canonicalized smiles, so we store the result with the input
+        smiles as key, and the rxn-canonicalized smiles as an alias pointing to it.
+        Both are RDKit-canonicalized, so in most cases they are the same key.
+        """
+        input_smiles_key = self.homogenize_smiles([smiles for smiles in reaction.split(".") if smiles])
+        prediction_smiles = prediction.get("smiles", "").split(">>")[0].split(".")
+        prediction_smiles_key = self.homogenize_smiles(prediction_smiles)
+        self.store_result_cache(
+            name=self._get_cache_name(),
+            key=input_smiles_key,
+            payload=prediction,
+            aliases=[prediction_smiles_key],
+        )
+
+    def _get_cache_name(self):
+        """
+        Get the cache name for the current model and topn parameters.
+
+        predict-reaction-<model_name>
+        predict-reaction-<model_name>-topn-<int>
+        """
+        topn = self._get_topn()
+        topn_str = f"-topn-{topn}" if topn else ""
+        return f"predict-reaction-{self.using_params.get('ai_model')}{topn_str}"
+
+    def _get_topn(self):
+        """
+        Get the topn parameter as an integer, or None for regular predictions.
+        """
+        topn = self.using_params.get("topn") or self._get_backward_compatible_topn()
+        try:
+            return int(topn) or None
+        except (TypeError, ValueError):
+            return None
+
+    def _retrieve_topn_result_cache_many(self, keys, topn):
+        """
+        Answer a topn query from cached results for the same model with a higher topn.
+
+        A topn=10 result contains the topn=3 result: its first 3 predictions.
+        For every key, the smallest cached topn >= the requested topn is
+        truncated to the requested number of predictions.
+        """
+        name_prefix = f"predict-reaction-{self.using_params.get('ai_model')}-topn-"
+        variants_by_key = self.retrieve_result_cache_variants(name_prefix, keys)
+
+        output = {}
+        for key, variants in variants_by_key.items():
+            best_topn = None
+            for name, prediction in variants.items():
+                try:
+                    cached_topn = int(name[len(name_prefix) :])
+                except ValueError:
+                    continue
+                if cached_topn >= topn and prediction and (best_topn is None or cached_topn < best_topn):
+                    best_topn = cached_topn
+                    output[key] = prediction
+
+            if key in output:
+                prediction = output[key]
+                output[key] = {
+                    **prediction,
+                    "results": prediction.get("results", [])[:topn],
+                    "raw_results": prediction.get("raw_results", [])[:topn],
+                }
+
+        return output
+
     def _api_get_task_id(self):
         """
         Launch a query and return the task ID.
         """
+        if not self.wait_for_project():
+            return False
+
         retries = 0
         max_retries = 5
         try_again = True
@@ -379,7 +482,7 @@ class PredictReactions(RXNPlugin):
 
                 # raise Exception("This is a test error")
                 ai_model = self.using_params.get("ai_model")
-                topn = self.using_params.get("topn") or self._get_backward_compatible_topn()
+                topn = self._get_topn()
 
                 # Note: RXN provides a separate API endpoint for single reactions,
                 # which returns a bit more data including an image, but we don't use
@@ -389,7 +492,7 @@ class PredictReactions(RXNPlugin):
                 # task_id = launch_job_response.get("prediction_id")
                 # response = self.api.get_predict_reaction_results(task_id)
 
-                if topn not in [None, 0, "0"]:
+                if topn:
                     # Batch topn function - https://github.com/rxn4chemistry/rxn4chemistry/blob/9bfd050153ac754298353c1de52e45bb6bb9cf97/rxn4chemistry/core.py#L507
                     # This endpoint consumes reactions as lists instead of strings.
                     reactions_list_sanitized = [r.split(".") for r in self.reactions_list_sanitized]
@@ -400,16 +503,17 @@ class PredictReactions(RXNPlugin):
 
                 if not launch_job_response:
                     raise ValueError("Empty server response")
+                if self.retry_policy.throttled():
+                    raise ValueError("Server busy")
                 if not launch_job_response.get("task_id"):
                     raise ValueError("No task_id returned")
                 try_again = False
 
             except Exception as err:  # pylint: disable=broad-exception-caught
-                sleep(2)
                 retries = retries + 1
-                if retries > max_retries:
+                if retries > max_retries or not self.retry_policy.retry(retries):
                     spinner.stop()
-                    output_error([f"Server unresponsive after {max_retries} retries", err], return_val=False)
+                    output_error([f"Server unresponsive after {retries - 1} retries", err], return_val=False)
                     return False
 
         task_id = launch_job_response.get("task_id")
@@ -438,8 +542,7 @@ class PredictReactions(RXNPlugin):
                     spinner.start(f"Processing prediction - retry #{retries}")
 
                 # raise Exception("This is a test error")
-                topn = self.using_params.get("topn") or self._get_backward_compatible_topn()
-                if topn not in [None, 0, "0"]:
+                if self._get_topn():
                     response = self.api.get_predict_reaction_batch_topn_results(task_id)
                 else:
                     response = self.api.get_predict_reaction_batch_results(task_id)
@@ -458,12 +561,12 @@ class PredictReactions(RXNPlugin):
 
             # Still running, keep trying
             except Warning as err:  # pylint: disable=broad-exception-caught
-                sleep(2)
                 retries = retries + 1
                 if retries > max_retries:
                     spinner.stop()
                     output_error([f"Server unresponsive after {max_retries} retries", err], return_val=False)
                     return False
+                sleep(self.retry_policy.poll_delay(retries, self.poll_base_seconds, self.poll_cap_seconds))
 
             # Error, abort
             except ValueError as err:
@@ -640,8 +743,7 @@ class PredictReactions(RXNPlugin):
 
         # Valid reaction
         else:
-            flag = "cached" if from_cache else ""
-            header_print_str = self.___print_str__header(index, flag)
+            header_print_str = self.___print_str__header(index, self.___get_cached_flag(prediction, from_cache))
             if rich_output:
                 reaction_print_str = self.___print_str_rich__reaction(input_smiles, prediction)
                 confidence_print_str = self.___print_str__confidence(prediction.get("confidence"))
@@ -670,8 +772,7 @@ class PredictReactions(RXNPlugin):
 
         # Note: invalid reactions get parsed by __generate_print_str()
 
-        flag = "cached" if from_cache else ""
-        header_print_str = self.___print_str__header(index, flag)
+        header_print_str = self.___print_str__header(index, self.___get_cached_flag(prediction, from_cache))
         if rich_output:
             reaction_print_str = self.___print_str_rich__reaction_topn(input_smiles, prediction)
         else:
@@ -680,6 +781,15 @@ class PredictReactions(RXNPlugin):
 
         return print_str
 
+    def ___get_cached_flag(self, prediction: dict, from_cache: bool) -> str:
+        """
+        Get the header flag of a valid result: 'cached', or 'cached from retrosynthesis'
+        for predictions seeded by `rxn predict retrosynthesis`, see PredictRetro._seed_reaction_cache().
+        """
+        if not from_cache:
+            return ""
+        return "cached from retrosynthesis" if (prediction or {}).get("seeded_from") else "cached"
+
     def ___print_str__header(self, index: int = None, flag: str = ""):
         """
         Get the header for a single reaction print.
@@ -697,10 +807,8 @@ class PredictReactions(RXNPlugin):
         index_str = " Result" if index is None else f" #{index}"
 
         # Flag
-        if flag == "cached":
-            flag = self.get_flag("cached")
-        elif flag == "failed":
-            flag = self.get_flag("failed")
+        if flag:
+            flag = self.get_flag(flag)
 
         # Assemble for Jupyter Notebook
         if GLOBAL_SETTINGS["display"] == "notebook":
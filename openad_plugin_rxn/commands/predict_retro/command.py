@@ -12,7 +12,7 @@ from openad_plugin_rxn.plugin_grammar_def import (
     predict,
     retrosynthesis,
     clause_rich_output,
-    clause_use_cache,
+    clause_use_cache_or_legacy,
     clause_return_df,
 )
 from openad_plugin_rxn.plugin_params import PLUGIN_NAME, PLUGIN_KEY, PLUGIN_NAMESPACE
@@ -46,7 +46,7 @@ class PluginCommand:
                 + molecule_identifier("smiles")
                 + clause_using
                 + clause_rich_output
-                + clause_use_cache
+                + clause_use_cache_or_legacy
                 + clause_return_df
                 # Failed attempt to allow clauses in random order... to be tested
                 # + py.ZeroOrMore(py.MatchFirst([clause_using, clause_rich_output, clause_use_cache]))
@@ -59,7 +59,7 @@ class PluginCommand:
                 plugin_name=PLUGIN_NAME,
                 plugin_namespace=PLUGIN_NAMESPACE,
                 category=self.category,
-                command=f"{PLUGIN_NAMESPACE} predict retrosynthesis|retro <smiles> [ USING (<parameter>=<value> <parameter>=<value>) ] [ rich ] [ use cache ] [ return df ]",
+                command=f"{PLUGIN_NAMESPACE} predict retrosynthesis|retro <smiles> [ USING (<parameter>=<value> <parameter>=<value>) ] [ rich ] [ use cache | use legacy cache ] [ return df ]",
                 description=description,
             )
         )
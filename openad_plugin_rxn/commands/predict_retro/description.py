@@ -36,12 +36,18 @@ description = f"""Get a molecule's retrosynthesis route prediction.
     What version of the retrosynthesis prediction model to use. The default is '2020-07-01'.
     To see available model versions, run <cmd>rxn list models</cmd> and look at the versions listed next to retrosynthesis-prediction-model.
 
+<cmd>seed_reaction_cache=<boolean|model_name></cmd>
+    Store every step of the resulting routes in the reaction prediction cache, so <cmd>rxn predict reaction ... use cache</cmd> on the same step doesn't need to call RXN. Pass the name of a reaction prediction model to store the steps under that model, or true to use its default model. Existing reaction predictions are never overwritten. This parameter is not sent to RXN and does not affect which cached results are reused. The default is false.
+
 
 <h1>Clauses</h1>
 
 {CLAUSES["rich_output"]}
 
 {CLAUSES["use_cache"]}
+    Results are only reused when they were generated with the same parameters.
+
+{CLAUSES["use_legacy_cache"]}
 
 <cmd>return df</cmd>
     Return the reaction tree as a Pandas DataFrame instead of as JSON.
@@ -53,4 +59,5 @@ description = f"""Get a molecule's retrosynthesis route prediction.
 - <cmd>rxn predict retrosynthesis 'BrCCc1cccc2c(Br)c3ccccc3cc12' use cache</cmd>
 - <cmd>rxn predict retrosynthesis 'BrCCc1cccc2c(Br)c3ccccc3cc12' using (max_steps=3)</cmd>
 - <cmd>rxn predict retrosynthesis 'BrCCc1cccc2c(Br)c3ccccc3cc12' using (max_steps=6 ai_model='12class-tokens-2021-05-14')</cmd>
+- <cmd>rxn predict retrosynthesis 'BrCCc1cccc2c(Br)c3ccccc3cc12' using (max_steps=3 seed_reaction_cache=true)</cmd>
 """
@@ -1,11 +1,10 @@
-from time import sleep
+from time import time
 import pandas as pd
 from IPython.display import display, HTML
 
 # OpenAD
 from openad.app.global_var_lib import GLOBAL_SETTINGS
-from openad.smols.smol_cache import create_analysis_record, save_result
-from openad.smols.smol_functions import canonicalize, valid_smiles
+from openad.smols.smol_cache import create_analysis_record
 
 # OpenAD tools
 from openad_tools.spinner import spinner
@@ -17,7 +16,10 @@ from openad_tools.jupyter import jup_display_input_molecule
 # Plugin
 from openad_plugin_rxn.plugin_msg import msg
 from openad_plugin_rxn.plugin_params import PLUGIN_KEY
-from openad_plugin_rxn.plugin_master_class import RXNPlugin
+from openad_plugin_rxn.plugin_master_class import RXNPlugin, canonicalize_smiles
+from openad_plugin_rxn.plugin_cache import params_digest
+from openad_plugin_rxn.plugin_retry import AdaptivePoller
+from openad_plugin_rxn.commands.predict_reactions.predict_reactions import PredictReactions
 
 
 class PredictRetro(RXNPlugin):
@@ -30,15 +32,17 @@ class PredictRetro(RXNPlugin):
 
     # API
     api = None
+    job_started = None  # When the last job was submitted, see _api_get_results()
 
     # Command
     input_smiles = None
     using_params = {}
     use_cache = False
+    use_legacy_cache = False
 
     # Error messages
     err_msg_unknown = "Something went wrong"
-    err_unresponsive_retries = "Server unresponsive, failed after 10 retries"
+    err_unresponsive_retries = "Server unresponsive, failed after {retries} retries"
     err_msg_process_fail = "Failed to process"
 
     # Default parameters
@@ -53,10 +57,25 @@ class PredictRetro(RXNPlugin):
         "nbeams": 10,
         "pruning_steps": 2,
         "ai_model": "2020-07-01",
+        "seed_reaction_cache": None,
     }
 
+    # USING parameters that hold a list of SMILES, delimited with a period
+    smiles_list_params = ["available_smiles", "exclude_smiles", "exclude_substructures"]
+
+    # List parameters that hold SMARTS patterns, they're sorted but not canonicalized as SMILES
+    smarts_list_params = ["exclude_substructures"]
+
+    # USING parameters that only affect the plugin, they're not sent to RXN and not part of the cache key
+    plugin_params = ["seed_reaction_cache"]
+
     # Cached result
     result_from_cache = None
+    result_from_legacy_cache = False
+
+    # Sub-routes cache, see _store_subroutes()
+    subroutes_cache_prefix = "retro-subroutes-"
+    max_subroutes = 10  # Highest-confidence sub-routes kept per intermediate
 
     # Debugging: skip API call and use placeholder result
     debug = False
@@ -89,15 +108,42 @@ class PredictRetro(RXNPlugin):
             return
 
         # Check if result is in cache
-        input_smiles_key = canonicalize(self.input_smiles)
+        input_smiles_key = canonicalize_smiles(self.input_smiles)
         if self.use_cache:
             self.result_from_cache = self.retrieve_result_cache(
-                name=f"predict-retro-{self.using_params.get('ai_model')}",
+                name=self._get_cache_name(),
                 key=input_smiles_key,
             )
 
+        # Fall back to results cached without their parameters
+        if not self.result_from_cache and self.use_legacy_cache:
+            self.result_from_cache = self.retrieve_result_cache(
+                name=self._get_cache_name(legacy=True),
+                key=input_smiles_key,
+            )
+            self.result_from_legacy_cache = bool(self.result_from_cache)
+
+        # Count hits & misses for rxn cache stats
+        if self.use_cache:
+            hit = bool(self.result_from_cache)
+            self.record_cache_lookups(self._get_cache_name(), int(hit), int(not hit))
+
+        # Skip targets that RXN rejected before with the same parameters
+        if self.use_cache and not self.result_from_cache:
+            rejection = self.retrieve_result_cache(name=self._get_cache_name(rejected=True), key=input_smiles_key)
+            if rejection:
+                output_error(
+                    [
+                        rejection.get("message"),
+                        "<soft>This target was rejected by RXN before, run without <cmd>use cache</cmd> to try again</soft>",
+                    ],
+                    return_val=False,
+                )
+                return
+
         # Not in cache -> run the job
         if not self.result_from_cache:
+            self._display_known_subroutes(input_smiles_key)
 
             # STEP 1: Launch job and get task ID
             if self.debug:
@@ -115,13 +161,6 @@ class PredictRetro(RXNPlugin):
                 if not retrosynthetic_paths:
                     return
 
-            # Save result in cache
-            self.store_result_cache(
-                name=f"predict-retro-{self.using_params.get('ai_model')}",
-                key=input_smiles_key,
-                payload=retrosynthetic_paths,
-            )
-
         # In cache -> use result
         else:
             retrosynthetic_paths = self.result_from_cache
@@ -131,20 +170,31 @@ class PredictRetro(RXNPlugin):
         if not reactions_dict_list:
             return
 
+        # Save new results in cache
+        if not self.result_from_cache:
+            self._store_result(input_smiles_key, retrosynthetic_paths, reactions_dict_list)
+
+        # Optionally store every step of the routes as a forward reaction prediction
+        seed_ai_model = self._get_seed_ai_model()
+        if seed_ai_model:
+            self._seed_reaction_cache(seed_ai_model, input_smiles_key, reactions_dict_list)
+
         # Save results as analysis records that can be merged
         # with the molecule working set in a follow up comand:
         # `enrich mols with analysis`
-        save_result(
+        self.save_analysis_record(
             create_analysis_record(
                 smiles=self.input_smiles,
                 toolkit=PLUGIN_KEY,
                 function="predict_retrosynthesis",
                 parameters=self.using_params,
                 results=reactions_dict_list,
-            ),
-            self.cmd_pointer,
+            )
         )
 
+        # Results are written to disk in the background
+        self.flush_writes()
+
         # STEP 4: Display results or return data
         if GLOBAL_SETTINGS["display"] == "api":
             if "return_df" in self.cmd:
@@ -168,7 +218,7 @@ class PredictRetro(RXNPlugin):
         """
         # Parse input SMILES
         self.input_smiles = self.cmd.get("smiles", [None])[0]
-        if not self.input_smiles or not valid_smiles(self.input_smiles):
+        if not self.input_smiles or canonicalize_smiles(self.input_smiles) is None:
             output_error(["Provided SMILES is invalid", f"Input SMILES: '{self.input_smiles}'"], return_val=False)
             return False
         # self.input_smiles = canonicalize(self.input_smiles) # Makes it harder to tie input and output together
@@ -185,15 +235,249 @@ class PredictRetro(RXNPlugin):
         self.using_params = self.parse_using_params(self.cmd, self.using_params_defaults)
 
         # Parse use_cache clause
-        self.use_cache = bool(self.cmd.get("use_cache"))
+        self.use_legacy_cache = bool(self.cmd.get("use_legacy_cache"))
+        self.use_cache = bool(self.cmd.get("use_cache")) or self.use_legacy_cache
 
         return True
 
+    def _get_cache_name(self, legacy=False, rejected=False):
+        """
+        Get the cache name for the current model and parameters.
+
+        predict-retro-<model_name>-params-<params_digest>
+
+        Legacy results were cached without their parameters:
+        predict-retro-<model_name>
+
+        Targets rejected by RXN are stored in the negative cache:
+        rejected-predict-retro-<model_name>-params-<params_digest>
+        """
+        name = f"predict-retro-{self.using_params.get('ai_model')}"
+        if legacy:
+            return name
+        name = f"{name}-params-{params_digest(self._get_normalized_params())}"
+        return f"rejected-{name}" if rejected else name
+
+    def _get_job_params(self) -> str:
+        """
+        Get the parameters that drive how long a job takes, to compare its duration with similar jobs.
+
+        max_steps=<int>-nbeams=<int>
+        """
+        return f"max_steps={self.using_params.get('max_steps')}-nbeams={self.using_params.get('nbeams')}"
+
+    def _get_api_params(self) -> dict:
+        """
+        Get the USING parameters that are sent to RXN.
+        """
+        return {key: self.using_params.get(key) for key in self.using_params_defaults if key not in self.plugin_params}
+
+    def _store_result(self, input_smiles_key: str, retrosynthetic_paths: list, reactions_dict_list: list):
+        """
+        Save a new result in the cache, and index its routes by intermediate for `rxn cache routes`.
+        """
+        self.store_result_cache(
+            name=self._get_cache_name(),
+            key=input_smiles_key,
+            payload=retrosynthetic_paths,
+        )
+        self._store_subroutes(input_smiles_key, reactions_dict_list)
+
+    def _store_rejection(self, input_smiles_key: str, rxn_error_msg: str):
+        """
+        Remember that RXN rejected a target, so it can be skipped next time.
+        """
+        self.store_result_cache(
+            name=self._get_cache_name(rejected=True),
+            key=input_smiles_key,
+            payload={"message": rxn_error_msg},
+        )
+
+    def _get_subroutes_cache_name(self):
+        """
+        Get the cache name for the sub-routes generated by the current model.
+
+        retro-subroutes-<model_name>
+        """
+        return f"{self.subroutes_cache_prefix}{self.using_params.get('ai_model')}"
+
+    def _store_subroutes(self, target_smiles: str, reactions_dict_list: list):
+        """
+        Store the sub-route leading up to every molecule in the routes
+        that is synthesized itself, keyed by its canonical SMILES.
+
+        Routes of different targets often share intermediates, so a new
+        target may already have known sub-routes before a job is submitted.
+
+        Each cache entry holds a list of sub-routes:
+        {
+            'target': <smiles of the route's target>,
+            'confidence': <confidence of the sub-route's last step>,
+            'params': <normalized USING parameters>,
+            'params_digest': <digest of the parameters>,
+            'tree': <sub-route, see __parse_retrosynthesis_tree>,
+            'created': <timestamp>
+        }
+        """
+        params = self._get_normalized_params()
+        digest = params_digest(params)
+        now = time()
+        subroutes = {}
+
+        def _collect(node):
+            if not isinstance(node, dict):
+                return
+            key = canonicalize_smiles(node.get("value")) or node.get("value")
+            subroutes.setdefault(key, []).append(
+                {
+                    "target": target_smiles,
+                    "confidence": node.get("_confidence"),
+                    "params": params,
+                    "params_digest": digest,
+                    "tree": node,
+                    "created": now,
+                }
+            )
+            for child in node.get("children", []):
+                _collect(child)
+
+        for reactions_dict in reactions_dict_list:
+            _collect(reactions_dict)
+        if not subroutes:
+            return
+
+        # Merge with the sub-routes we already know, newest first so they win over duplicates
+        name = self._get_subroutes_cache_name()
+        known_subroutes = self.retrieve_result_cache_many(name=name, keys=list(subroutes))
+        payloads = {}
+        for key, new_subroutes in subroutes.items():
+            merged = {}
+            for subroute in new_subroutes + known_subroutes.get(key, []):
+                merged.setdefault(params_digest([subroute["params_digest"], subroute["tree"]]), subroute)
+            payloads[key] = sorted(merged.values(), key=lambda x: x.get("confidence") or 0, reverse=True)[
+                : self.max_subroutes
+            ]
+        self.store_result_cache_many(name=name, payloads=payloads)
+
+    def _get_seed_ai_model(self):
+        """
+        Get the reaction prediction model to seed with the steps of the routes, see _seed_reaction_cache().
+
+        seed_reaction_cache=true -> default reaction prediction model
+        seed_reaction_cache='<model_name>' -> '<model_name>'
+        seed_reaction_cache=false -> None
+        """
+        ai_model = self.using_params.get("seed_reaction_cache")
+        if ai_model is None or ai_model is False or str(ai_model).strip().lower() in ["", "false", "none"]:
+            return None
+        if ai_model is True or str(ai_model).strip().lower() == "true":
+            return PredictReactions.using_params_defaults["ai_model"]
+        return str(ai_model).strip()
+
+    def _seed_reaction_cache(self, ai_model: str, target_smiles: str, reactions_dict_list: list):
+        """
+        Store every step of the routes in the reaction prediction cache under ai_model,
+        so forward checks of the proposed routes can be served without the API.
+
+        Existing predictions are never overwritten, and seeded
+        ones are marked with where they came from:
+        {
+            'smiles': 'AA.BB>>CC',
+            'confidence': 0.95,
+            'seeded_from': {
+                'function': 'predict-retro',
+                'ai_model': <retrosynthesis model>,
+                'target': <smiles of the route's target>
+            }
+        }
+        """
+        seeded_from = {
+            "function": "predict-retro",
+            "ai_model": self.using_params.get("ai_model"),
+            "target": target_smiles,
+        }
+        steps = {}
+
+        def _collect(node):
+            if not isinstance(node, dict):
+                return
+            children = node.get("children", [])
+            precursors = [child if isinstance(child, str) else child.get("value") for child in children]
+            steps.setdefault(
+                self.homogenize_smiles(precursors),
+                {
+                    "smiles": f"{'.'.join(precursors)}>>{node.get('value')}",
+                    "confidence": node.get("_confidence"),
+                    "seeded_from": seeded_from,
+                },
+            )
+            for child in children:
+                _collect(child)
+
+        for reactions_dict in reactions_dict_list:
+            _collect(reactions_dict)
+
+        name = f"predict-reaction-{ai_model}"
+        existing = self.retrieve_result_cache_many(name=name, keys=list(steps))
+        self.store_result_cache_many(
+            name=name, payloads={key: step for key, step in steps.items() if key not in existing}
+        )
+
+    def _display_known_subroutes(self, smiles_key: str):
+        """
+        Let the user know when sub-routes for the target are in the cache, from any model.
+        """
+        known_subroutes = self.retrieve_result_cache_variants(self.subroutes_cache_prefix, [smiles_key])
+        count = sum(len(subroutes) for subroutes in known_subroutes.get(smiles_key, {}).values())
+        if count:
+            output_text(
+                f"<soft>{count} known sub-route{'' if count == 1 else 's'} for this molecule, "
+                f"run <cmd>rxn cache routes '{self.input_smiles}'</cmd> to see them</soft>",
+                return_val=False,
+            )
+
+    def _get_normalized_params(self):
+        """
+        Normalize the USING parameters so equivalent values produce the same cache key.
+
+        - SMILES lists are canonicalized and sorted: 'OCC.BrBr' -> 'BrBr.CCO'
+        - SMARTS lists are only sorted: 'C.[#6]' -> 'C.[#6]'
+        - Numbers are parsed: '0.6' -> 0.6, 5 -> 5.0
+        - Booleans are parsed: 'true' -> True
+        - Empty values are unified: '' -> None
+        """
+        normalized_params = {}
+        for key, val in self.using_params.items():
+            if key in self.plugin_params:
+                continue
+            if isinstance(val, str):
+                val = val.strip()
+                if val == "":
+                    val = None
+                elif key in self.smiles_list_params:
+                    val = self.homogenize_smiles(
+                        [smiles for smiles in val.split(".") if smiles], canonical=key not in self.smarts_list_params
+                    )
+                elif val.lower() in ["true", "false"]:
+                    val = val.lower() == "true"
+                else:
+                    try:
+                        val = float(val)
+                    except ValueError:
+                        pass
+            elif isinstance(val, (int, float)) and not isinstance(val, bool):
+                val = float(val)
+            normalized_params[key] = val
+        return normalized_params
+
     def _api_get_task_id(self):
         """
         Launch job and return task id.
         Retry up to 10 times upon failure.
         """
+        if not self.wait_for_project():
+            return
+
         retries = 0
         max_retries = 10
         status = False
@@ -207,28 +491,18 @@ class PredictRetro(RXNPlugin):
 
                 # Run query
                 # raise Exception("This is a test error")
-                job_response = self.api.predict_automatic_retrosynthesis(
-                    self.input_smiles,
-                    availability_pricing_threshold=self.using_params.get("availability_pricing_threshold"),
-                    available_smiles=self.using_params.get("available_smiles"),
-                    exclude_smiles=self.using_params.get("exclude_smiles"),
-                    exclude_substructures=self.using_params.get("exclude_substructures"),
-                    exclude_target_molecule=self.using_params.get("exclude_target_molecule"),
-                    fap=self.using_params.get("fap"),
-                    max_steps=self.using_params.get("max_steps"),
-                    nbeams=self.using_params.get("nbeams"),
-                    pruning_steps=self.using_params.get("pruning_steps"),
-                    ai_model=self.using_params.get("ai_model"),
-                )
+                self.job_started = time()
+                job_response = self.api.predict_automatic_retrosynthesis(self.input_smiles, **self._get_api_params())
+                if self.retry_policy.throttled():
+                    raise ValueError(["Server busy", job_response])
                 status = True
 
-            # Fail - failed to connect
+            # Fail - failed to connect or server busy
             except Exception as err:  # pylint: disable=broad-exception-caught
-                sleep(2)
                 retries = retries + 1
-                if retries > max_retries:
+                if retries > max_retries or not self.retry_policy.retry(retries):
                     spinner.stop()
-                    output_error([self.err_unresponsive_retries, err], return_val=False)
+                    output_error([self.err_unresponsive_retries.format(retries=retries - 1), err], return_val=False)
                     return
 
         # Fail - empty response
@@ -237,16 +511,18 @@ class PredictRetro(RXNPlugin):
             output_error(["The server returned an empty response", job_response], return_val=False)
             return
 
-        if not job_response.get("prediction_id"):
-            spinner.stop()
-            output_error(["The server failed to provide a prediction ID", job_response], return_val=False)
-            return
-
         # Fail - error from RXN
+        # Note: rejected jobs don't come with a prediction ID, so this is checked first
         rxn_error_msg = job_response.get("response", {}).get("payload", {}).get("errorMessage")
         if rxn_error_msg:
             spinner.stop()
             output_error(rxn_error_msg, return_val=False)
+            self._store_rejection(canonicalize_smiles(self.input_smiles), rxn_error_msg)
+            return
+
+        if not job_response.get("prediction_id"):
+            spinner.stop()
+            output_error(["The server failed to provide a prediction ID", job_response], return_val=False)
             return
 
         task_id = job_response.get("prediction_id")
@@ -254,13 +530,13 @@ class PredictRetro(RXNPlugin):
 
     def _api_get_results(self, task_id):
         """
-        Check the status of the job every 10 seconds and return the results when ready.
+        Check the status of the job and return the results when ready.
 
-        Retry up to 30 times upon failure (5 minutes max).
+        Checks are timed on how long similar jobs took before, see AdaptivePoller.
         """
+        poller = AdaptivePoller(self.get_job_durations("predict-retro", self._get_job_params()), self.job_started)
         retries = 0
-        wait_seconds = 10
-        max_retries = 30  # 5 minutes max
+        failures = 0
         try_again = True
         response = None
         error_TOAST = 0
@@ -291,6 +567,7 @@ class PredictRetro(RXNPlugin):
 
                 if response.get("status") == "SUCCESS":
                     try_again = False
+                    self.record_job_duration("predict-retro", self._get_job_params(), poller.elapsed())
                     retrosynthetic_paths = response.get("retrosynthetic_paths")
                     spinner.succeed("Done")
                     if not retrosynthetic_paths:
@@ -298,8 +575,9 @@ class PredictRetro(RXNPlugin):
                     return retrosynthetic_paths
 
                 # Job not ready yet - count down and check again
-                if retries < max_retries:
+                if not poller.expired():
                     retries = retries + 1
+                    wait_seconds = max(1, round(poller.next_delay()))
                     spinner.countdown(
                         seconds=wait_seconds,
                         msg="Processing retrosynthesis - next check in {sec} seconds",
@@ -312,7 +590,7 @@ class PredictRetro(RXNPlugin):
 
             # Server took too long
             except TimeoutError:
-                total_time_waited = retries * wait_seconds
+                total_time_waited = round(poller.elapsed())
                 minutes = total_time_waited // 60
                 seconds = total_time_waited % 60
                 time_str = f"{minutes} minutes and {seconds} seconds" if minutes > 0 else f"{seconds} seconds"
@@ -326,10 +604,14 @@ class PredictRetro(RXNPlugin):
                 )
                 return False
 
-            # Other errors
+            # Other errors - try again within the retry budget
             except Exception as err:  # pylint: disable=broad-exception-caught
+                failures = failures + 1
+                if try_again and self.retry_policy.retry(failures):
+                    continue
                 spinner.stop()
                 output_error(["Something went wrong", err], return_val=False)
+                return False
 
     def _simplify_results(self, retrosynthetic_paths):
         """
@@ -700,6 +982,9 @@ class PredictRetro(RXNPlugin):
 
         # Optional CACHED flag
         flag = self.get_flag("cached") if self.result_from_cache else ""
+        if self.result_from_legacy_cache:
+            flag = self.get_flag("legacy cache")
+            output.append("<soft>Legacy cache result: the parameters used to generate it are unknown</soft>")
         # Assemble results
         for i, reactions_dict in enumerate(reactions_dict_list):
             if "rich_output" in self.cmd:
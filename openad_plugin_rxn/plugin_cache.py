@@ -0,0 +1,1282 @@
+import io
+import os
+import re
+import json
+import atexit
+import time
+import gzip
+import zlib
+import pickle
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Plugin
+from openad_plugin_rxn.plugin_params import CACHE_SETTINGS
+
+
+def key_digest(key: str) -> str:
+    """
+    Return the fixed-length digest of a cache key.
+    """
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def cache_namespace(name: str) -> str:
+    """
+    Return the namespace of a cache name, used to apply size and age limits.
+
+    predict-reaction-2020-08-10-topn-3 -> predict-reaction
+    """
+    for namespace in CACHE_SETTINGS["namespaces"]:
+        if name.startswith(f"{namespace}-"):
+            return namespace
+    return name
+
+
+def cache_ai_model(name: str) -> str:
+    """
+    Return the model name of a cache name.
+
+    predict-reaction-2020-08-10-topn-3 -> 2020-08-10
+    predict-retro-12class-tokens-2021-05-14-params-0123456789abcdef -> 12class-tokens-2021-05-14
+    rejected-predict-retro-2020-07-01-params-0123456789abcdef -> 2020-07-01
+    rejected-invalid-smiles -> ''
+    """
+    namespace = cache_namespace(name)
+    if namespace == name:
+        return ""
+
+    # Negative cache: the name of the function that rejected the input follows the prefix
+    if namespace == "rejected":
+        return cache_ai_model(name[len(namespace) + 1 :])
+
+    ai_model = name[len(namespace) + 1 :]
+    return re.sub(r"-(topn|params)-[^-]+$", "", ai_model)
+
+
+def params_digest(params: dict) -> str:
+    """
+    Return a short, stable digest of a dictionary of parameters.
+    """
+    params_str = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(params_str.encode("utf-8")).hexdigest()[:16]
+
+
+def _is_locked_error(err: sqlite3.OperationalError) -> bool:
+    """
+    Check if an error was caused by another connection holding the lock.
+    """
+    return "locked" in str(err) or "busy" in str(err)
+
+
+# Payload serialization
+# ---------------------
+
+PAYLOAD_FORMAT_PICKLE = 0  # Written by older versions, read only
+PAYLOAD_FORMAT_JSON = 1  # zlib-compressed compact JSON
+
+
+class _PayloadUnpickler(pickle.Unpickler):
+    """
+    Unpickler for payloads cached by older versions of the plugin.
+
+    Payloads are plain API responses, which only consist of builtin
+    types that don't need any lookups, so every global is refused.
+    This keeps a tampered cache file from executing code.
+    """
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Refusing to load '{module}.{name}' from the cache")
+
+
+def serialize_payload(payload) -> bytes:
+    """
+    Serialize a payload in the current format.
+    """
+    payload_str = json.dumps(payload, separators=(",", ":"), default=str)
+    return zlib.compress(payload_str.encode("utf-8"))
+
+
+def deserialize_payload(blob: bytes, payload_format: int):
+    """
+    Deserialize a payload stored in any of the supported formats.
+    """
+    if payload_format == PAYLOAD_FORMAT_JSON:
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+    if payload_format == PAYLOAD_FORMAT_PICKLE:
+        return _PayloadUnpickler(io.BytesIO(blob)).load().get("payload")
+    raise ValueError(f"Unknown cache payload format: {payload_format}")
+
+
+def project_payload(name: str, payload):
+    """
+    Strip the fields the plugin doesn't use from a payload before it's cached.
+
+    Retrosynthesis trees carry ids, timestamps and metadata on every node,
+    only the SMILES, confidence and children are kept.
+    """
+    if cache_namespace(name) == "predict-retro" and isinstance(payload, list):
+        return [_project_retro_tree(tree) for tree in payload]
+    return payload
+
+
+def _project_retro_tree(tree):
+    """
+    Keep only the fields of a retrosynthesis tree that are used for display.
+    """
+    if not isinstance(tree, dict):
+        return tree
+    output = {"smiles": tree.get("smiles"), "confidence": tree.get("confidence")}
+    if tree.get("children"):
+        output["children"] = [_project_retro_tree(branch) for branch in tree["children"]]
+    return output
+
+
+class MemoryCache:
+    """
+    Bounded in-memory LRU cache, used as a tier in front of the database.
+
+    The size of an entry is approximated by the size of its serialized payload.
+    Payloads are returned as-is, so they should be treated as read-only.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        """
+        Parameters
+        ----------
+        max_entries: int
+            Maximum number of entries to keep in memory.
+        max_bytes: int
+            Approximate maximum memory footprint of the payloads.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # (db_path, name, key) -> (payload, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, cache_key: tuple):
+        """
+        Return (True, payload) on a hit and (False, None) on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(cache_key)
+            self.hits += 1
+            return True, entry[0]
+
+    def put(self, cache_key: tuple, payload, size: int):
+        """
+        Add or replace an entry, evicting the least recently used entries when over budget.
+
+        Payloads that don't fit the budget are not kept, and neither is the entry they replace.
+        """
+        with self.lock:
+            if cache_key in self.entries:
+                self.size -= self.entries.pop(cache_key)[1]
+            if size > self.max_bytes or self.max_entries <= 0:
+                return
+            self.entries[cache_key] = (payload, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self, db_path: str = None):
+        """
+        Remove all entries, or only the entries belonging to one database.
+        """
+        with self.lock:
+            if db_path is None:
+                self.entries.clear()
+                self.size = 0
+                return
+            for cache_key in [cache_key for cache_key in self.entries if cache_key[0] == db_path]:
+                self.size -= self.entries.pop(cache_key)[1]
+
+    def stats(self) -> dict:
+        """
+        Return the hit/miss counters and current footprint.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+class WriteBehindQueue:
+    """
+    Queue of writes that are run in batches by a background thread,
+    so the caller doesn't have to wait on the disk.
+
+    A batch is written once flush_size items are pending, flush_delay seconds
+    after the first item came in, or as soon as flush() is called. Errors raised
+    while writing are kept until they are collected with pop_errors().
+    """
+
+    def __init__(self, write_batch, flush_size: int, flush_delay: float, name: str = "rxn-write-behind"):
+        """
+        Parameters
+        ----------
+        write_batch: callable
+            Called from the background thread with the list of pending items.
+        flush_size: int
+            Number of pending items that triggers a write.
+        flush_delay: float
+            Maximum number of seconds an item stays pending.
+        name: str
+            Name of the background thread.
+        """
+        self.write_batch = write_batch
+        self.flush_size = flush_size
+        self.flush_delay = flush_delay
+        self.name = name
+        self.items = []
+        self.errors = []
+        self.writing = False
+        self.flush_requested = False
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def put(self, item):
+        """
+        Queue an item to be written.
+        """
+        with self.condition:
+            self.items.append(item)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.thread.start()
+            if len(self.items) >= self.flush_size:
+                self.condition.notify_all()
+
+    def flush(self, wait: bool = True, timeout: float = None) -> bool:
+        """
+        Write the pending items now.
+
+        With wait, block until they're written, returns False when the timeout ran out first.
+        Should not be called while holding a lock that write_batch needs.
+        """
+        with self.condition:
+            if not self.items and not self.writing:
+                return True
+            self.flush_requested = True
+            self.condition.notify_all()
+            if not wait:
+                return True
+            return self.condition.wait_for(lambda: not self.items and not self.writing, timeout)
+
+    def pop_errors(self) -> list:
+        """
+        Return and forget the errors raised by the writes so far.
+        """
+        with self.condition:
+            errors = self.errors
+            self.errors = []
+            return errors
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.items)
+                self.condition.wait_for(
+                    lambda: self.flush_requested or len(self.items) >= self.flush_size, self.flush_delay
+                )
+                items = self.items
+                self.items = []
+                self.flush_requested = False
+                self.writing = True
+            try:
+                self.write_batch(items)
+            except Exception as err:  # pylint: disable=broad-except
+                with self.condition:
+                    self.errors.append(err)
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.condition.notify_all()
+
+
+# Memory tier shared by all RXNPlugin commands in the process
+memory_cache = MemoryCache(CACHE_SETTINGS["memory_max_entries"], CACHE_SETTINGS["memory_max_bytes"])
+
+
+class RXNCache:
+    """
+    Indexed result cache for RXN, stored in a single SQLite file per workspace.
+
+    /<workspace>/._openad/rxn_cache/rxn_cache.db
+
+    Every entry is identified by a name, which describes the function
+    and model that created it, and a key, which is the input SMILES:
+    - name: predict-reaction-<model_name>
+    - name: predict-reaction-<model_name>-topn-<int>
+    - name: predict-retro-<model_name>-params-<params_digest>
+    - name: predict-retro-<model_name> (legacy, parameters unknown)
+    - name: retro-subroutes-<model_name>
+    - name: rejected-invalid-smiles
+    - name: rejected-predict-retro-<model_name>-params-<params_digest>
+
+    The rejected namespace is a negative cache: inputs that are known to fail,
+    so they can be skipped. Its entries expire after a TTL, see CACHE_SETTINGS.
+
+    Each payload is stored once in the entries table. The aliases table
+    maps any number of keys to it, eg. both the input SMILES and the
+    SMILES as canonicalized by RXN. Removing an entry removes its aliases.
+
+    Aliases are indexed by the fixed-length digest of their key, so keys
+    of any length can be cached. The raw key is stored with the alias and
+    compared on retrieval to rule out collisions.
+
+    Reads go through the process-wide memory tier first. Writes go to the
+    memory tier right away, and are queued to be written to the database in
+    batches by a background thread, see WriteBehindQueue. Until then, reads
+    are served from the queue. Operations on the whole database, like clear()
+    or export_bundle(), first wait for the queued writes.
+
+    Payloads are stored as zlib-compressed JSON, with only the fields
+    the plugin uses, see project_payload(). Entries pickled by older
+    versions are loaded with a restricted unpickler and upgraded when read.
+
+    Every namespace (predict-reaction, predict-retro) has its own byte
+    budget and maximum age, see CACHE_SETTINGS. Entries track when they
+    were last accessed, and the least recently used entries are evicted
+    first once a namespace goes over budget. Limits are enforced when the
+    cache is opened, every ENFORCE_LIMITS_INTERVAL writes, and on compact().
+
+    The job_durations table keeps how long recent RXN jobs took, so the
+    status checks of similar jobs can be timed, see AdaptivePoller.
+
+    Several kernels or processes can share a workspace cache. The database
+    runs in WAL mode, so readers never block and never see a partial write,
+    while writes take the write lock up front (BEGIN IMMEDIATE) and wait
+    for each other up to CACHE_SETTINGS["busy_timeout_seconds"].
+    """
+
+    DB_FILENAME = "rxn_cache.db"
+    LEGACY_PREFIX = "rxn-"
+    LEGACY_SUFFIX = ".result"
+    SCHEMA_VERSION = 8
+    AGE_BUCKETS = [("< 1 day", 1), ("< 1 week", 7), ("< 1 month", 30), ("< 6 months", 182), ("older", None)]
+    ENFORCE_LIMITS_INTERVAL = 100  # Number of writes between limit checks
+    TOUCH_FLUSH_SIZE = 500  # Number of pending access times before they're written
+    WRITE_FLUSH_SIZE = 200  # Number of queued writes before they're written
+    WRITE_FLUSH_DELAY = 2  # Maximum number of seconds a write stays queued
+    EVICTION_TARGET = 0.9  # When over budget, evict down to this fraction of the budget
+    MAX_QUERY_PARAMS = 900  # SQLite allows 999 parameters per query on older versions
+    LOCK_RETRIES = 3  # Attempts to start a write transaction after the busy timeout ran out
+    JOB_DURATIONS_KEPT = 50  # Most recent job durations kept per kind and parameters
+    BUNDLE_FORMAT = "openad-rxn-cache-bundle"
+    BUNDLE_VERSION = 1
+
+    cache_dir = None
+    db_path = None
+    conn = None
+    writes_since_limits_check = 0
+
+    def __init__(self, cache_dir: str):
+        """
+        Parameters
+        ----------
+        cache_dir: str
+            The directory where the cache database is stored.
+        """
+        self.cache_dir = cache_dir
+        self.db_path = os.path.join(cache_dir, self.DB_FILENAME)
+        self.lock = threading.RLock()
+        self.pending_touches = {}  # (name, digest) -> last access time
+        self.pending_lookups = {}  # name -> [hits, misses]
+        self.pending_upgrades = {}  # entry id -> payload re-serialized in the current format
+        self.pending_payloads = {}  # (name, key) -> payload queued to be written
+        self.pending_lock = threading.Lock()
+        self.writer = WriteBehindQueue(self._write_queued, self.WRITE_FLUSH_SIZE, self.WRITE_FLUSH_DELAY)
+        self.conn = sqlite3.connect(
+            self.db_path,
+            timeout=CACHE_SETTINGS["busy_timeout_seconds"],
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        try:
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+        except sqlite3.OperationalError:
+            pass  # Eg. file systems without shared memory support, the default rollback journal is still safe
+        self.conn.create_function("key_digest", 1, key_digest, deterministic=True)
+        self.conn.create_function("cache_namespace", 1, cache_namespace, deterministic=True)
+        self.conn.create_function("cache_ai_model", 1, cache_ai_model, deterministic=True)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self._create_tables()
+        self._import_legacy_files()
+        self.enforce_limits()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Run the enclosed queries in a single write transaction.
+
+        The write lock is taken when the transaction starts, so it can't
+        fail halfway when another process started writing in the meantime.
+        """
+        with self.lock:
+            for attempt in range(1, self.LOCK_RETRIES + 1):
+                try:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    break
+                except sqlite3.OperationalError as err:
+                    if attempt == self.LOCK_RETRIES or not _is_locked_error(err):
+                        raise
+                    time.sleep(attempt)
+            try:
+                yield self.conn
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _create_tables(self):
+        """
+        Create the tables, or upgrade them from an older schema version.
+        """
+        with self._transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= self.SCHEMA_VERSION:
+                return
+
+            # Version 0 -> 1: results were indexed by their raw key
+            if version < 1:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS entries (
+                        name TEXT NOT NULL,
+                        digest TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        payload BLOB NOT NULL,
+                        created REAL NOT NULL,
+                        PRIMARY KEY (name, digest)
+                    )
+                    """
+                )
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'results'").fetchone():
+                    conn.execute(
+                        """
+                        INSERT OR IGNORE INTO entries (name, digest, key, payload, created)
+                        SELECT name, key_digest(key), key, payload, created FROM results
+                        """
+                    )
+                    conn.execute("DROP TABLE results")
+
+            # Version 1 -> 2: look up a key across names, eg. all topn variants
+            if version < 2:
+                conn.execute("CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest)")
+
+            # Version 2 -> 3: payloads are stored once, with any number of aliases pointing to them
+            if version < 3:
+                conn.execute("ALTER TABLE entries RENAME TO entries_v2")
+                conn.execute("DROP INDEX IF EXISTS entries_digest")
+                conn.execute(
+                    """
+                    CREATE TABLE entries (
+                        id INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        payload BLOB NOT NULL,
+                        created REAL NOT NULL
+                    )
+                    """
+                )
+                conn.execute(
+                    """
+                    CREATE TABLE aliases (
+                        name TEXT NOT NULL,
+                        digest TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        entry_id INTEGER NOT NULL REFERENCES entries (id) ON DELETE CASCADE,
+                        PRIMARY KEY (name, digest)
+                    )
+                    """
+                )
+                conn.execute("CREATE INDEX aliases_digest ON aliases (digest)")
+                conn.execute("CREATE INDEX aliases_entry_id ON aliases (entry_id)")
+                conn.execute(
+                    "INSERT INTO entries (id, name, payload, created) SELECT rowid, name, payload, created FROM entries_v2"
+                )
+                conn.execute(
+                    "INSERT INTO aliases (name, digest, key, entry_id) SELECT name, digest, key, rowid FROM entries_v2"
+                )
+                conn.execute("DROP TABLE entries_v2")
+
+            # Version 3 -> 4: track size and last access for eviction
+            if version < 4:
+                conn.execute("ALTER TABLE entries ADD COLUMN namespace TEXT NOT NULL DEFAULT ''")
+                conn.execute("ALTER TABLE entries ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+                conn.execute("ALTER TABLE entries ADD COLUMN accessed REAL NOT NULL DEFAULT 0")
+                conn.execute(
+                    "UPDATE entries SET namespace = cache_namespace(name), size = length(payload), accessed = created"
+                )
+                conn.execute("CREATE INDEX entries_namespace_accessed ON entries (namespace, accessed)")
+
+            # Version 4 -> 5: inspect and clear the cache per model, keep track of the hit rate
+            if version < 5:
+                conn.execute("ALTER TABLE entries ADD COLUMN ai_model TEXT NOT NULL DEFAULT ''")
+                conn.execute("UPDATE entries SET ai_model = cache_ai_model(name)")
+                conn.execute("CREATE INDEX entries_namespace_ai_model ON entries (namespace, ai_model)")
+                conn.execute(
+                    """
+                    CREATE TABLE lookups (
+                        name TEXT PRIMARY KEY,
+                        hits INTEGER NOT NULL DEFAULT 0,
+                        misses INTEGER NOT NULL DEFAULT 0
+                    )
+                    """
+                )
+
+            # Version 5 -> 6: payloads are no longer pickled, existing entries are upgraded when read
+            if version < 6:
+                conn.execute(f"ALTER TABLE entries ADD COLUMN format INTEGER NOT NULL DEFAULT {PAYLOAD_FORMAT_PICKLE}")
+
+            # Version 6 -> 7: how long RXN jobs took, to time the status checks of similar jobs
+            if version < 7:
+                conn.execute(
+                    """
+                    CREATE TABLE job_durations (
+                        id INTEGER PRIMARY KEY,
+                        kind TEXT NOT NULL,
+                        params TEXT NOT NULL,
+                        duration REAL NOT NULL,
+                        finished REAL NOT NULL
+                    )
+                    """
+                )
+                conn.execute("CREATE INDEX job_durations_kind_params ON job_durations (kind, params, finished)")
+
+            # Version 7 -> 8: the model of rejected entries was read from the wrong part of their name
+            if version < 8:
+                conn.execute("UPDATE entries SET ai_model = cache_ai_model(name) WHERE namespace = 'rejected'")
+
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    # Read & write
+    # ------------
+
+    def store(self, name: str, key: str, payload, aliases: list = None) -> bool:
+        """
+        Store a payload under a name and key, replacing any existing entry.
+
+        The payload is stored once, aliases are additional keys that point to it.
+        """
+        keys = list(dict.fromkeys([key] + [alias for alias in aliases or [] if alias]))
+        payload = project_payload(name, payload)
+        self._queue_write(name, keys, payload, serialize_payload(payload), time.time())
+        return True
+
+    def store_many(self, name: str, payloads: dict) -> bool:
+        """
+        Store a batch of key -> payload pairs in a single transaction, replacing any existing entries.
+        """
+        now = time.time()
+        for key, payload in payloads.items():
+            payload = project_payload(name, payload)
+            self._queue_write(name, [key], payload, serialize_payload(payload), now)
+        return True
+
+    def _queue_write(self, name: str, keys: list, payload, blob: bytes, created: float):
+        """
+        Make a payload available to reads right away, and queue it to be written to the database.
+        """
+        if not self._expiry(name):
+            for key in keys:
+                memory_cache.put((self.db_path, name, key), payload, len(blob))
+        with self.pending_lock:
+            for key in keys:
+                self.pending_payloads[(name, key)] = payload
+        self.writer.put((name, keys, payload, blob, created))
+
+    def _write_queued(self, items: list):
+        """
+        Write a batch of queued payloads in a single transaction, in the order they were stored.
+
+        Runs in the writer's background thread.
+        """
+        with self._transaction() as conn:
+            for name, keys, _, blob, created in items:
+                digests = [key_digest(key) for key in keys]
+                replaced_ids = [
+                    row[0]
+                    for row in self._query_digests(
+                        "SELECT entry_id FROM aliases WHERE name = ? AND digest IN ({placeholders})", digests, (name,)
+                    )
+                ]
+                self._insert_entry(name, keys, digests, blob, created)
+                self._delete_orphans(replaced_ids)
+            self._write_touches(conn)
+
+        # Stop serving the payloads from the queue, unless they were replaced in the meantime
+        with self.pending_lock:
+            for name, keys, payload, _, _ in items:
+                for key in keys:
+                    if self.pending_payloads.get((name, key)) is payload:
+                        del self.pending_payloads[(name, key)]
+
+        # Enforce size and age limits incrementally
+        self.writes_since_limits_check += len(items)
+        if self.writes_since_limits_check >= self.ENFORCE_LIMITS_INTERVAL:
+            self.enforce_limits()
+
+    def flush_writes(self, wait: bool = True) -> bool:
+        """
+        Write the queued payloads now, see WriteBehindQueue.flush().
+        """
+        return self.writer.flush(wait)
+
+    def flush(self):
+        """
+        Write everything that's pending: queued payloads, access times and hit/miss counts.
+        """
+        self.flush_writes()
+        self.flush_touches()
+
+    def retrieve(self, name: str, key: str):
+        """
+        Retrieve a payload, returns None when there's no entry.
+        """
+        return self.retrieve_many(name, [key]).get(key)
+
+    def retrieve_many(self, name: str, keys: list) -> dict:
+        """
+        Retrieve the payloads for a batch of keys in one pass.
+
+        Returns a key -> payload dictionary, keys without an entry are left out.
+
+        Entries of namespaces with a TTL bypass the memory tier, so they expire on time.
+        """
+        output = {}
+        digests = {}
+        expiry = self._expiry(name)
+        for key in keys:
+            found, payload = memory_cache.get((self.db_path, name, key)) if not expiry else (False, None)
+            if not found:
+                with self.pending_lock:
+                    found = (name, key) in self.pending_payloads
+                    payload = self.pending_payloads.get((name, key))
+            if found:
+                output[key] = payload
+            else:
+                digests[key_digest(key)] = key
+
+        rows = self._query_digests(
+            """
+            SELECT aliases.digest, aliases.key, entries.id, entries.payload, entries.format FROM aliases
+            JOIN entries ON entries.id = aliases.entry_id
+            WHERE aliases.name = ? AND entries.created >= ? AND aliases.digest IN ({placeholders})
+            """,
+            list(digests),
+            (name, expiry),
+        )
+        for digest, key, entry_id, blob, payload_format in rows:
+            if digests[digest] == key:
+                try:
+                    output[key], size = self._load_payload(name, entry_id, blob, payload_format)
+                except Exception:  # pylint: disable=broad-except
+                    continue  # Unreadable entries are treated as a miss and replaced on the next store
+                if not expiry:
+                    memory_cache.put((self.db_path, name, key), output[key], size)
+
+        self._touch(name, list(output))
+        return output
+
+    def retrieve_variants(self, name_prefix: str, keys: list) -> dict:
+        """
+        Retrieve the payloads for a batch of keys from every entry whose name
+        starts with name_prefix, eg. all topn variants of a reaction prediction.
+
+        Returns a key -> {name: payload} dictionary, keys without an entry are left out.
+        """
+        digests = {key_digest(key): key for key in keys}
+        rows = self._query_digests(
+            """
+            SELECT aliases.name, aliases.digest, aliases.key, entries.id, entries.payload, entries.format FROM aliases
+            JOIN entries ON entries.id = aliases.entry_id
+            WHERE aliases.digest IN ({placeholders})
+            """,
+            list(digests),
+        )
+        output = {}
+        for name, digest, key, entry_id, blob, payload_format in rows:
+            if name.startswith(name_prefix) and digests[digest] == key:
+                try:
+                    payload = self._load_payload(name, entry_id, blob, payload_format)[0]
+                except Exception:  # pylint: disable=broad-except
+                    continue
+                output.setdefault(key, {})[name] = payload
+
+        # Payloads that are still queued replace what's in the database
+        keys = set(keys)
+        with self.pending_lock:
+            for (name, key), payload in self.pending_payloads.items():
+                if name.startswith(name_prefix) and key in keys:
+                    output.setdefault(key, {})[name] = payload
+        return output
+
+    def _load_payload(self, name: str, entry_id: int, blob: bytes, payload_format: int) -> tuple:
+        """
+        Deserialize a stored payload, returns (payload, size).
+
+        Payloads stored in an older format are projected and re-serialized,
+        and written back with the next batch of access times.
+        """
+        payload = deserialize_payload(blob, payload_format)
+        if payload_format == PAYLOAD_FORMAT_JSON:
+            return payload, len(blob)
+        payload = project_payload(name, payload)
+        blob = serialize_payload(payload)
+        with self.lock:
+            self.pending_upgrades[entry_id] = blob
+        return payload, len(blob)
+
+    def clear(
+        self, function: str = None, ai_model: str = None, older_than_days: float = None, smiles_pattern: str = None
+    ) -> int:
+        """
+        Remove entries and their aliases, returns the number of entries removed.
+
+        Without any filters, all entries are removed.
+
+        Parameters
+        ----------
+        function: str
+            Only remove entries of this function, eg. predict-retro
+        ai_model: str
+            Only remove entries generated by this model, eg. 2020-07-01
+        older_than_days: float
+            Only remove entries created more than this many days ago
+        smiles_pattern: str
+            Only remove entries with a key matching this glob pattern, eg. *Br*
+        """
+        self.flush_writes()
+        conditions = []
+        params = []
+        if function:
+            conditions.append("namespace = ?")
+            params.append(function)
+        if ai_model:
+            conditions.append("ai_model = ?")
+            params.append(ai_model)
+        if older_than_days is not None:
+            conditions.append("created < ?")
+            params.append(time.time() - float(older_than_days) * 24 * 60 * 60)
+        if smiles_pattern:
+            conditions.append("id IN (SELECT entry_id FROM aliases WHERE key GLOB ?)")
+            params.append(smiles_pattern)
+
+        with self._transaction() as conn:
+            if conditions:
+                count = conn.execute(f"DELETE FROM entries WHERE {' AND '.join(conditions)}", params).rowcount
+            else:
+                count = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                conn.execute("DELETE FROM aliases")
+                conn.execute("DELETE FROM entries")
+                conn.execute("DELETE FROM lookups")
+        memory_cache.clear(self.db_path)
+        return count
+
+    def record_lookups(self, name: str, hits: int, misses: int):
+        """
+        Count cache hits and misses for the hit rate.
+
+        Counts are kept in memory and written together with the access times.
+        """
+        with self.lock:
+            counts = self.pending_lookups.setdefault(name, [0, 0])
+            counts[0] += hits
+            counts[1] += misses
+
+    def stats(self) -> list:
+        """
+        Return statistics per function and model: number of entries,
+        size, hit rate and how many entries fall in each age bucket.
+        """
+        self.flush()
+        now = time.time()
+        age_columns = []
+        lower_bound = None
+        for _, max_days in self.AGE_BUCKETS:
+            created_after = f"created >= {now - max_days * 24 * 60 * 60}" if max_days else "1"
+            created_before = f"created < {now - lower_bound * 24 * 60 * 60}" if lower_bound else "1"
+            age_columns.append(f"SUM({created_after} AND {created_before})")
+            lower_bound = max_days
+
+        with self.lock:
+            rows = self.conn.execute(
+                f"""
+                SELECT namespace, ai_model, COUNT(*), SUM(size), {", ".join(age_columns)}
+                FROM entries GROUP BY namespace, ai_model ORDER BY namespace, ai_model
+                """
+            ).fetchall()
+            lookups = self.conn.execute("SELECT name, hits, misses FROM lookups").fetchall()
+
+        # Aggregate the hits and misses per function and model
+        lookups_by_model = {}
+        for name, hits, misses in lookups:
+            counts = lookups_by_model.setdefault((cache_namespace(name), cache_ai_model(name)), [0, 0])
+            counts[0] += hits
+            counts[1] += misses
+
+        output = []
+        for namespace, ai_model, entries, size, *age_counts in rows:
+            hits, misses = lookups_by_model.get((namespace, ai_model), [0, 0])
+            stats = {
+                "function": namespace,
+                "ai_model": ai_model,
+                "entries": entries,
+                "bytes": size or 0,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else None,
+            }
+            for (label, _), count in zip(self.AGE_BUCKETS, age_counts):
+                stats[f"age {label}"] = count or 0
+            output.append(stats)
+        return output
+
+    def _touch(self, name: str, keys: list):
+        """
+        Record that entries were read.
+
+        Access times are kept in memory and written in bulk, so reads
+        served from the memory tier don't have to wait on the disk.
+        """
+        if not keys:
+            return
+        now = time.time()
+        with self.lock:
+            for key in keys:
+                self.pending_touches[(name, key_digest(key))] = now
+            flush = len(self.pending_touches) >= self.TOUCH_FLUSH_SIZE
+        if flush:
+            self.flush_touches()
+
+    def flush_touches(self):
+        """
+        Write the pending access times and hit/miss counts to the database.
+        """
+        with self._transaction() as conn:
+            self._write_touches(conn)
+
+    def _write_touches(self, conn):
+        """
+        Write the pending access times and hit/miss counts as part of an ongoing transaction.
+        """
+        touches = self.pending_touches
+        self.pending_touches = {}
+        conn.executemany(
+            "UPDATE entries SET accessed = ? WHERE id = (SELECT entry_id FROM aliases WHERE name = ? AND digest = ?)",
+            [(accessed, name, digest) for (name, digest), accessed in touches.items()],
+        )
+
+        lookups = self.pending_lookups
+        self.pending_lookups = {}
+        conn.executemany(
+            """
+            INSERT INTO lookups (name, hits, misses) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses
+            """,
+            [(name, hits, misses) for name, (hits, misses) in lookups.items()],
+        )
+
+        upgrades = self.pending_upgrades
+        self.pending_upgrades = {}
+        conn.executemany(
+            "UPDATE entries SET payload = ?, format = ?, size = ? WHERE id = ? AND format = ?",
+            [
+                (blob, PAYLOAD_FORMAT_JSON, len(blob), entry_id, PAYLOAD_FORMAT_PICKLE)
+                for entry_id, blob in upgrades.items()
+            ],
+        )
+
+    # Job durations
+    # -------------
+
+    def record_job_duration(self, kind: str, params: str, duration: float):
+        """
+        Remember how long an RXN job took, only the JOB_DURATIONS_KEPT most recent are kept.
+
+        Parameters
+        ----------
+        kind: str
+            The type of job, eg. predict-retro
+        params: str
+            The parameters that affect the duration, eg. max_steps=3-nbeams=10
+        duration: float
+            Seconds between submitting the job and receiving the result
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO job_durations (kind, params, duration, finished) VALUES (?, ?, ?, ?)",
+                (kind, params, duration, time.time()),
+            )
+            conn.execute(
+                """
+                DELETE FROM job_durations WHERE kind = ? AND params = ? AND id NOT IN (
+                    SELECT id FROM job_durations WHERE kind = ? AND params = ? ORDER BY finished DESC, id DESC LIMIT ?
+                )
+                """,
+                (kind, params, kind, params, self.JOB_DURATIONS_KEPT),
+            )
+
+    def job_durations(self, kind: str, params: str) -> list:
+        """
+        Return the recorded durations of jobs with the same kind and parameters, in seconds.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT duration FROM job_durations WHERE kind = ? AND params = ?", (kind, params)
+            ).fetchall()
+        return [duration for (duration,) in rows]
+
+    # Bundles
+    # -------
+
+    def export_bundle(self, file_path: str) -> int:
+        """
+        Write every entry to a bundle file, returns the number of entries exported.
+
+        A bundle is a gzip-compressed JSON-lines file. The first line is a header,
+        every following line holds one payload with all the keys pointing to it:
+        {"name": <name>, "keys": [<key>, ...], "created": <timestamp>, "payload": <payload>}
+        """
+        self.flush()
+
+        # Read aliases and entries from the same snapshot, other processes may be writing
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                entry_keys = {}
+                for entry_id, key in self.conn.execute("SELECT entry_id, key FROM aliases ORDER BY entry_id"):
+                    entry_keys.setdefault(entry_id, []).append(key)
+                rows = self.conn.execute(
+                    "SELECT id, name, payload, format, created FROM entries ORDER BY id"
+                ).fetchall()
+            finally:
+                self.conn.execute("COMMIT")
+
+        # Write to a temporary file first, so an existing bundle
+        # is never left half-written when something goes wrong
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        try:
+            count = self._write_bundle(tmp_path, rows, entry_keys)
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return count
+
+    def _write_bundle(self, file_path: str, rows: list, entry_keys: dict) -> int:
+        """
+        Write entries to a bundle file, see export_bundle().
+        """
+        count = 0
+        with gzip.open(file_path, "wt", encoding="utf-8") as handle:
+            header = {"format": self.BUNDLE_FORMAT, "version": self.BUNDLE_VERSION, "created": time.time()}
+            handle.write(json.dumps(header) + "\n")
+            for entry_id, name, blob, payload_format, created in rows:
+                if entry_id not in entry_keys:
+                    continue
+                try:
+                    payload = self._load_payload(name, entry_id, blob, payload_format)[0]
+                except Exception:  # pylint: disable=broad-except
+                    continue
+                record = {"name": name, "keys": entry_keys[entry_id], "created": created, "payload": payload}
+                handle.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+                count += 1
+        return count
+
+    def import_bundle(self, file_path: str) -> dict:
+        """
+        Merge the entries of a bundle file into the cache.
+
+        When an entry exists in both, the most recently created one is kept.
+        Imported entries count as accessed now, so they aren't the first to be evicted.
+        Returns the number of entries imported and skipped.
+        """
+        self.flush_writes()
+        imported = 0
+        skipped = 0
+        now = time.time()
+        with gzip.open(file_path, "rt", encoding="utf-8") as handle:
+            header = json.loads(handle.readline() or "{}")
+            if header.get("format") != self.BUNDLE_FORMAT:
+                raise ValueError("Not an RXN cache bundle")
+            if header.get("version", 0) > self.BUNDLE_VERSION:
+                raise ValueError(f"Unsupported cache bundle version: {header.get('version')}")
+
+            with self._transaction() as conn:
+                for line in handle:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    name = record["name"]
+                    keys = list(dict.fromkeys(record["keys"]))
+                    digests = [key_digest(key) for key in keys]
+
+                    # Newest entry wins
+                    existing = self._query_digests(
+                        """
+                        SELECT entries.id, entries.created FROM aliases
+                        JOIN entries ON entries.id = aliases.entry_id
+                        WHERE aliases.name = ? AND aliases.digest IN ({placeholders})
+                        """,
+                        digests,
+                        (name,),
+                    )
+                    if any(created >= record["created"] for _, created in existing):
+                        skipped += 1
+                        continue
+
+                    blob = serialize_payload(project_payload(name, record["payload"]))
+                    self._insert_entry(name, keys, digests, blob, record["created"], accessed=now)
+                    self._delete_orphans([entry_id for entry_id, _ in existing])
+                    imported += 1
+                self._write_touches(conn)
+
+        memory_cache.clear(self.db_path)
+        self.enforce_limits()
+        return {"imported": imported, "skipped": skipped}
+
+    # Size & age limits
+    # -----------------
+
+    def enforce_limits(self) -> int:
+        """
+        Evict entries that are past their namespace's TTL or max age, then evict the
+        least recently used entries of every namespace that is over its byte budget.
+
+        Returns the number of entries evicted.
+
+        Evicted entries may live on in the memory tier until they're pushed out,
+        which is harmless as their payload is still valid.
+        """
+        self.writes_since_limits_check = 0
+        evicted = 0
+        now = time.time()
+        with self._transaction() as conn:
+            self._write_touches(conn)
+            for namespace, limits in CACHE_SETTINGS["namespaces"].items():
+                # TTL, counted from when the entry was created
+                if limits.get("ttl_days"):
+                    evicted += conn.execute(
+                        "DELETE FROM entries WHERE namespace = ? AND created < ?",
+                        (namespace, now - limits["ttl_days"] * 24 * 60 * 60),
+                    ).rowcount
+
+                # Max age, counted from when the entry was last accessed
+                if limits.get("max_age_days"):
+                    oldest_allowed = now - limits["max_age_days"] * 24 * 60 * 60
+                    evicted += conn.execute(
+                        "DELETE FROM entries WHERE namespace = ? AND accessed < ?", (namespace, oldest_allowed)
+                    ).rowcount
+
+                # Byte budget
+                max_bytes = limits.get("max_bytes")
+                if not max_bytes:
+                    continue
+                total_bytes = conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?", (namespace,)
+                ).fetchone()[0]
+                if total_bytes <= max_bytes:
+                    continue
+                evict_ids = []
+                rows = conn.execute(
+                    "SELECT id, size FROM entries WHERE namespace = ? ORDER BY accessed ASC", (namespace,)
+                )
+                for entry_id, size in rows:
+                    if total_bytes <= max_bytes * self.EVICTION_TARGET:
+                        break
+                    evict_ids.append((entry_id,))
+                    total_bytes -= size
+                conn.executemany("DELETE FROM entries WHERE id = ?", evict_ids)
+                evicted += len(evict_ids)
+        return evicted
+
+    def compact(self) -> dict:
+        """
+        Enforce the size and age limits, then rebuild the database file to reclaim the freed space.
+
+        Returns the number of evicted entries and the file size before and after.
+        """
+        self.flush_writes()
+        size_before = self._file_size()
+        evicted = self.enforce_limits()
+        with self.lock:
+            self.conn.execute("VACUUM")
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return {
+            "evicted": evicted,
+            "size_before": size_before,
+            "size_after": self._file_size(),
+        }
+
+    # Helpers
+    # -------
+
+    def _expiry(self, name: str) -> float:
+        """
+        Return the creation time before which entries under this name have expired,
+        or 0 when their namespace has no TTL.
+        """
+        ttl_days = CACHE_SETTINGS["namespaces"].get(cache_namespace(name), {}).get("ttl_days")
+        return time.time() - ttl_days * 24 * 60 * 60 if ttl_days else 0
+
+    def _file_size(self) -> int:
+        """
+        Return the size of the database on disk, including changes not yet checkpointed from the WAL file.
+        """
+        size = 0
+        for path in [self.db_path, f"{self.db_path}-wal"]:
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
+    def _query_digests(self, sql: str, digests: list, params: tuple = ()) -> list:
+        """
+        Run a query for a list of key digests, in chunks that fit SQLite's parameter limit.
+
+        The query should contain a {placeholders} marker, where the digests are inserted.
+        """
+        rows = []
+        with self.lock:
+            for i in range(0, len(digests), self.MAX_QUERY_PARAMS):
+                digests_chunk = digests[i : i + self.MAX_QUERY_PARAMS]
+                placeholders = ", ".join("?" * len(digests_chunk))
+                rows.extend(self.conn.execute(sql.format(placeholders=placeholders), (*params, *digests_chunk)))
+        return rows
+
+    def _insert_entry(
+        self, name: str, keys: list, digests: list, blob: bytes, created: float, accessed: float = None
+    ) -> int:
+        """
+        Insert a serialized payload and point its keys to it, as part of an ongoing transaction.
+
+        Returns the id of the new entry. Entries that lose all of
+        their aliases should be removed with _delete_orphans().
+        """
+        entry_id = self.conn.execute(
+            """
+            INSERT INTO entries (name, namespace, ai_model, payload, format, size, created, accessed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                name,
+                cache_namespace(name),
+                cache_ai_model(name),
+                blob,
+                PAYLOAD_FORMAT_JSON,
+                len(blob),
+                created,
+                accessed or created,
+            ),
+        ).lastrowid
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO aliases (name, digest, key, entry_id) VALUES (?, ?, ?, ?)",
+            [(name, digest, key, entry_id) for digest, key in zip(digests, keys)],
+        )
+        return entry_id
+
+    def _delete_orphans(self, entry_ids: list):
+        """
+        Delete entries that no longer have any alias pointing to them.
+        """
+        self.conn.executemany(
+            "DELETE FROM entries WHERE id = ? AND NOT EXISTS (SELECT 1 FROM aliases WHERE entry_id = entries.id)",
+            [(entry_id,) for entry_id in set(entry_ids)],
+        )
+
+    # Migration
+    # ---------
+
+    def _import_legacy_files(self):
+        """
+        Import the one-pickle-per-result files from previous versions of
+        the plugin into the database, then remove them.
+
+        /<workspace>/._openad/rxn_cache/rxn-<name>--<key>.result
+        """
+        legacy_files = [
+            entry
+            for entry in os.scandir(self.cache_dir)
+            if entry.is_file() and entry.name.startswith(self.LEGACY_PREFIX) and entry.name.endswith(self.LEGACY_SUFFIX)
+        ]
+        if not legacy_files:
+            return
+
+        rows = []
+        for entry in legacy_files:
+            name_key = entry.name[len(self.LEGACY_PREFIX) : -len(self.LEGACY_SUFFIX)]
+            if "--" not in name_key:
+                continue
+            name, key = name_key.split("--", 1)
+            try:
+                with open(entry.path, "rb") as handle:
+                    payload = deserialize_payload(handle.read(), PAYLOAD_FORMAT_PICKLE)
+                blob = serialize_payload(project_payload(name, payload))
+                rows.append((name, key, blob, entry.stat().st_mtime))
+            except Exception:  # pylint: disable=broad-except
+                continue
+
+        with self._transaction() as conn:
+            for name, key, blob, created in rows:
+                entry_id = conn.execute(
+                    """
+                    INSERT INTO entries (name, namespace, ai_model, payload, format, size, created, accessed)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        name,
+                        cache_namespace(name),
+                        cache_ai_model(name),
+                        blob,
+                        PAYLOAD_FORMAT_JSON,
+                        len(blob),
+                        created,
+                        created,
+                    ),
+                ).lastrowid
+                inserted = conn.execute(
+                    "INSERT OR IGNORE INTO aliases (name, digest, key, entry_id) VALUES (?, ?, ?, ?)",
+                    (name, key_digest(key), key, entry_id),
+                ).rowcount
+                if not inserted:
+                    conn.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+
+        for entry in legacy_files:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+# One open cache per database, shared by all commands in the process
+_open_caches = {}
+_open_caches_lock = threading.Lock()
+
+
+def get_cache(cache_dir: str) -> RXNCache:
+    """
+    Return the cache stored in cache_dir, opening it if required.
+    """
+    with _open_caches_lock:
+        if cache_dir not in _open_caches:
+            _open_caches[cache_dir] = RXNCache(cache_dir)
+            atexit.register(_open_caches[cache_dir].flush)
+        return _open_caches[cache_dir]
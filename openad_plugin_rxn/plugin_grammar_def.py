@@ -11,6 +11,12 @@ login = py.CaselessKeyword("login")
 
 clear = py.CaselessKeyword("clear")
 cache = py.CaselessKeyword("cache")
+compact = py.CaselessKeyword("compact")
+stats = py.CaselessKeyword("stats")
+e_xport = py.CaselessKeyword("export")
+i_mport = py.CaselessKeyword("import")
+routes = py.CaselessKeyword("routes")
+warm = py.CaselessKeyword("warm")
 
 predict = py.CaselessKeyword("predict")
 retrosynthesis = py.MatchFirst([py.CaselessKeyword("retrosynthesis"), py.CaselessKeyword("retro")])
@@ -23,4 +29,13 @@ clause_rich_output = py.Optional(py.CaselessKeyword("rich")("rich_output"))
 clause_use_cache = py.Optional(
     py.MatchFirst([py.CaselessKeyword("use cache"), py.CaselessKeyword("use_saved")])("use_cache")
 )
+# Retrosynthesis results cached before the USING parameters were part of the cache key
+clause_use_cache_or_legacy = py.Optional(
+    py.MatchFirst(
+        [
+            py.CaselessKeyword("use legacy cache")("use_legacy_cache"),
+            py.MatchFirst([py.CaselessKeyword("use cache"), py.CaselessKeyword("use_saved")])("use_cache"),
+        ]
+    )
+)
 clause_return_df = py.Optional(py.CaselessKeyword("return df")("return_df"))
@@ -0,0 +1,152 @@
+import time
+import threading
+from email.utils import parsedate_to_datetime
+from http.cookiejar import DefaultCookiePolicy
+import requests
+from requests.adapters import HTTPAdapter
+import rxn4chemistry.core
+
+# Plugin
+from openad_plugin_rxn.plugin_params import HTTP_SETTINGS
+
+
+class PooledRequests:
+    """
+    Stand-in for the requests module as used by rxn4chemistry, which sends
+    every call through the shared session so connections are kept alive.
+
+    rxn4chemistry calls requests.get(), requests.post() etc. at module level,
+    which opens a new connection (and TLS handshake) for every API call,
+    including every status check while a job is running.
+
+    Anything other than the request functions is looked up on the requests module.
+    """
+
+    def __init__(self, session: requests.Session):
+        """
+        Parameters
+        ----------
+        session: requests.Session
+            The session used to send the requests.
+        """
+        self.session = session
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.session.put(url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.session.patch(url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.session.delete(url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+# Retry-After
+# -----------
+
+# HTTP status codes that come with a Retry-After header worth honoring
+RETRY_AFTER_STATUS_CODES = [429, 503]
+
+# Throttling of the last response per thread, rxn4chemistry doesn't pass the response headers on
+_last_response = threading.local()
+
+
+def parse_retry_after(value: str):
+    """
+    Parse a Retry-After header, either a number of seconds or an HTTP date.
+
+    Returns the number of seconds to wait, or None if it can't be parsed.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _record_throttle(response, *args, **kwargs):  # pylint: disable=unused-argument
+    """
+    Session response hook that remembers whether the server throttled the call.
+    """
+    if response.status_code in RETRY_AFTER_STATUS_CODES:
+        _last_response.throttle_status = response.status_code
+        _last_response.retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    else:
+        _last_response.throttle_status = None
+        _last_response.retry_after = None
+    return response
+
+
+def get_throttle_status():
+    """
+    Return the status code of the last response in this thread if it was throttled (429 or 503), else None.
+
+    rxn4chemistry returns throttled responses as regular error dicts, this tells them apart.
+    """
+    return getattr(_last_response, "throttle_status", None)
+
+
+def pop_retry_after():
+    """
+    Return and forget the Retry-After of the last throttled response in this thread, if any.
+    """
+    seconds = getattr(_last_response, "retry_after", None)
+    _last_response.throttle_status = None
+    _last_response.retry_after = None
+    return seconds
+
+
+# Session
+# -------
+
+# One session per process, shared by all commands
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Return the process-wide session, creating it if required.
+
+    The connection pool holds up to HTTP_SETTINGS["pool_size"] keep-alive connections per host.
+    Cookies are not kept between calls, same as with module-level requests.
+    Throttled responses record their Retry-After, see pop_retry_after().
+    """
+    global _session  # pylint: disable=global-statement
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, HTTP_SETTINGS["pool_size"]))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.hooks["response"].append(_record_throttle)
+            _session = session
+        return _session
+
+
+def install_session():
+    """
+    Route the API calls of rxn4chemistry through the shared session.
+
+    Safe to call more than once, the session is only installed the first time.
+    """
+    if not isinstance(rxn4chemistry.core.requests, PooledRequests):
+        rxn4chemistry.core.requests = PooledRequests(get_session())
@@ -1,24 +1,261 @@
 import os
 import json
+import glob
+import hashlib
 import pandas as pd
 import shutil
-from time import sleep
+import threading
+from time import sleep, time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from requests.exceptions import MissingSchema, HTTPError, ConnectionError
 
 # OpenAD
 from openad.helpers.credentials import load_credentials, get_credentials, write_credentials
 
 # OpenAD tools
+from openad_tools.spinner import spinner
 from openad_tools.output import output_text, output_success, output_warning, output_error
 from openad_tools.helpers import confirm_prompt
 
 # Plugin
 from openad_plugin_rxn.plugin_msg import msg
-from openad_plugin_rxn.plugin_params import PLUGIN_KEY, PLUGIN_NAME
+from openad_plugin_rxn.plugin_params import PLUGIN_KEY, PLUGIN_NAME, LOGIN_SETTINGS
+from openad_plugin_rxn.plugin_http import install_session
+from openad_plugin_rxn.plugin_retry import RetryPolicy
 from rxn4chemistry import RXN4ChemistryWrapper
 
 
+class LoginSession:
+    """
+    Process-wide record of the last validated login, so commands can skip
+    the credentials and project checks while nothing changed.
+
+    The login is checked again when the client or workspace changed,
+    the credentials file was modified or removed, or after
+    LOGIN_SETTINGS["session_ttl_seconds"].
+    """
+
+    client = None  # The validated RXN4ChemistryWrapper
+    workspace = None  # Workspace the RXN project was synced for
+    project_id = None  # RXN project of the workspace
+    cred_mtime = None  # Modification time of the credentials file
+    validated_at = 0
+
+    def is_valid(self, client, workspace: str, cred_path: str) -> bool:
+        """
+        Check if the login can be reused for this client, workspace and credentials file.
+        """
+        return bool(
+            self.client is not None
+            and client is self.client
+            and workspace == self.workspace
+            and _file_mtime(cred_path) == self.cred_mtime
+            and time() - self.validated_at < LOGIN_SETTINGS["session_ttl_seconds"]
+        )
+
+    def update(self, client, workspace: str, project_id: str, cred_path: str):
+        """
+        Record a validated login.
+        """
+        self.client = client
+        self.workspace = workspace
+        self.project_id = project_id
+        self.cred_mtime = _file_mtime(cred_path)
+        self.validated_at = time()
+
+    def reset(self):
+        """
+        Forget the login, so the next command validates it again.
+        """
+        self.client = None
+        self.workspace = None
+        self.project_id = None
+        self.cred_mtime = None
+        self.validated_at = 0
+
+
+def _file_mtime(path: str):
+    """
+    Return the modification time of a file, or None if it doesn't exist.
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+# One login per process, shared by all commands
+login_session = LoginSession()
+
+
+def identity_fingerprint(host: str, api_key: str) -> str:
+    """
+    Return a fingerprint of the API host and key, so a validated identity
+    can be tied to the credentials without storing the key.
+    """
+    return hashlib.sha256(f"{host}\n{api_key}".encode("utf-8")).hexdigest()
+
+
+# Fingerprints of credentials found to be invalid by a background check, see RXNLoginManager._revalidate_identity()
+_revoked_fingerprints = set()
+
+
+class ProjectRegistry:
+    """
+    Index of the RXN projects created per workspace, stored as JSON in:
+
+    /<home_dir>/RXN_Projects/rxn_projects.pkl
+    {"<WORKSPACE_NAME>": "<project_id>", ...}
+
+    The file is read once and again only when it was modified, eg. by another process.
+    Changes are written atomically, followed by a timestamped backup copy.
+    Only the most recent MAX_BACKUPS backups are kept.
+    """
+
+    FILENAME = "rxn_projects.pkl"
+    BACKUP_PREFIX = "rxn_projects_"
+    BACKUP_SUFFIX = ".bup"
+    MAX_BACKUPS = 10
+
+    def __init__(self, projects_dir: str):
+        """
+        Parameters
+        ----------
+        projects_dir: str
+            The directory where the registry file is stored.
+        """
+        self.projects_dir = projects_dir
+        self.path = os.path.join(projects_dir, self.FILENAME)
+        self.projects = {}
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    def all(self) -> dict:
+        """
+        Return all projects as a name -> project id dictionary.
+        """
+        with self.lock:
+            self._load()
+            return dict(self.projects)
+
+    def get(self, project_name: str):
+        """
+        Return the id of a project, or False if it's not registered.
+        """
+        with self.lock:
+            self._load()
+            return self.projects.get(project_name, False)
+
+    def add(self, project_name: str, project_id: str) -> bool:
+        """
+        Register a project, returns False when the registry couldn't be written.
+        """
+        with self.lock:
+            self._load()
+            self.projects[project_name] = project_id
+            try:
+                os.makedirs(self.projects_dir, exist_ok=True)
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as handle:
+                    json.dump(self.projects, handle)
+                os.replace(tmp_path, self.path)
+                self.mtime = _file_mtime(self.path)
+            except Exception:  # pylint: disable=broad-exception-caught
+                return False
+
+            self._backup()
+            return True
+
+    def _load(self):
+        """
+        (Re)load the registry file if it changed since it was last read.
+        """
+        mtime = _file_mtime(self.path)
+        if mtime == self.mtime:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as handle:
+                self.projects = json.loads(handle.read())
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.projects = {}
+        self.mtime = mtime
+
+    def _backup(self):
+        """
+        Copy the registry to a timestamped backup, and remove the oldest backups over MAX_BACKUPS.
+        """
+        try:
+            timestamp = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+            shutil.copyfile(
+                self.path, os.path.join(self.projects_dir, f"{self.BACKUP_PREFIX}{timestamp}{self.BACKUP_SUFFIX}")
+            )
+            backups = sorted(glob.glob(os.path.join(self.projects_dir, f"{self.BACKUP_PREFIX}*{self.BACKUP_SUFFIX}")))
+            for backup in backups[: -self.MAX_BACKUPS]:
+                os.remove(backup)
+        except OSError:
+            pass
+
+
+# One registry per projects directory, shared by all commands
+_project_registries = {}
+_project_registries_lock = threading.Lock()
+
+
+def get_project_registry(projects_dir: str) -> ProjectRegistry:
+    """
+    Return the project registry stored in projects_dir.
+    """
+    with _project_registries_lock:
+        if projects_dir not in _project_registries:
+            _project_registries[projects_dir] = ProjectRegistry(projects_dir)
+        return _project_registries[projects_dir]
+
+
+class ProjectBootstrap:
+    """
+    RXN project being created for a new workspace in the background.
+
+    Creating a project takes several seconds, which overlap with the
+    command's own preparation. Only submitting a job has to wait for it.
+    """
+
+    def __init__(self, create_project):
+        """
+        Parameters
+        ----------
+        create_project: callable
+            Creates the project and returns its id, raises an exception on failure.
+        """
+        self.started = time()
+        self.finished = None
+        self.reported = False
+        self.future = _bootstrap_executor.submit(self._run, create_project)
+
+    def _run(self, create_project):
+        try:
+            return create_project()
+        finally:
+            self.finished = time()
+
+    def done(self) -> bool:
+        """
+        Check if the bootstrap finished, successfully or not.
+        """
+        return self.future.done()
+
+    def duration(self) -> float:
+        """
+        Return the number of seconds the bootstrap took, or has been running for.
+        """
+        return (self.finished or time()) - self.started
+
+
+# Projects are created one at a time, keyed by workspace name
+_bootstrap_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rxn-project-bootstrap")
+_project_bootstraps = {}
+
+
 class RXNLoginManager:
     """
     Login manager for RXN
@@ -26,6 +263,7 @@ class RXNLoginManager:
 
     cmd_pointer = None
     cred_path = None
+    identity_path = None
     RXN_VARS_TEMPLATE = {"current_project": None, "current_project_id": None}
     API_CONFIG_BLANK = {"host": "None", "auth": {"username": "None", "api_key": "None"}, "verify_ssl": "false"}
     DEFAULT_URL = "https://rxn.app.accelerate.science"
@@ -40,10 +278,27 @@ class RXNLoginManager:
         """
         self.cmd_pointer = cmd_pointer
         self.cred_path = os.path.expanduser(f"{self.cmd_pointer.home_dir}/rxn_api.cred")
+        self.identity_path = os.path.expanduser(f"{self.cmd_pointer.home_dir}/rxn_api.identity")
 
     def login(self):
         """Login to RXN"""
 
+        # Reuse connections to the RXN server across API calls and commands
+        install_session()
+
+        # A background check found the API key to be invalid
+        if _revoked_fingerprints:
+            _revoked_fingerprints.clear()
+            login_session.reset()
+            output_warning(
+                ["Your RXN API key is no longer valid", "Run <cmd>rxn login reset</cmd> to log in again"],
+                return_val=False,
+            )
+
+        # Nothing changed since the last command
+        if login_session.is_valid(self._get_client(), self.cmd_pointer.settings["workspace"], self.cred_path):
+            return False
+
         # Check for credentials file
         login_reset = bool(not os.path.isfile(self.cred_path))
 
@@ -53,6 +308,7 @@ class RXNLoginManager:
             name, project_id = self.get_current_project()  # pylint: disable=unused-variable
             if name != self.cmd_pointer.settings["workspace"]:
                 self._sync_workspace_rxn_project()
+            self._update_login_session()
             return False
 
         # ------------------------------------------------
@@ -71,6 +327,7 @@ class RXNLoginManager:
             if username:
                 # Link API to the project associated with your current workspace
                 self._sync_workspace_rxn_project()
+                self._update_login_session()
                 return username
             else:
                 return False
@@ -100,9 +357,24 @@ class RXNLoginManager:
 
                 # Test API
                 else:
+                    # Credentials validated recently -> check again in the background
+                    fingerprint = identity_fingerprint(config_file["host"], config_file["auth"]["api_key"])
+                    response = None
+                    username = self._get_cached_identity(fingerprint)
+                    if username:
+                        threading.Thread(
+                            target=self._revalidate_identity,
+                            args=(self.api, fingerprint),
+                            name="rxn-identity-check",
+                            daemon=True,
+                        ).start()
+
                     # Will throw MissingSchema exception if the host is invalid
-                    response = self.api.current_user().get("response", {}) or {}
-                    username = response.get("payload", {}).get("email") if response else None
+                    else:
+                        response = RetryPolicy(budget=3).call(self.api.current_user).get("response", {}) or {}
+                        username = response.get("payload", {}).get("email") if response else None
+                        if username:
+                            self._store_identity(fingerprint, username)
 
                     # Response looks ok, store API credentials
                     if username:
@@ -144,6 +416,84 @@ class RXNLoginManager:
                     os.remove(self.cred_path)
                 return False
 
+    def _get_cached_identity(self, fingerprint: str):
+        """
+        Return the username validated for these credentials, unless it's
+        older than LOGIN_SETTINGS["identity_ttl_seconds"].
+        """
+        try:
+            with open(self.identity_path, "r", encoding="utf-8") as handle:
+                identity = json.loads(handle.read())
+        except Exception:  # pylint: disable=broad-exception-caught
+            return None
+        if identity.get("fingerprint") != fingerprint:
+            return None
+        if time() - identity.get("validated_at", 0) >= LOGIN_SETTINGS["identity_ttl_seconds"]:
+            return None
+        return identity.get("username")
+
+    def _store_identity(self, fingerprint: str, username: str):
+        """
+        Remember that these credentials are valid, see _get_cached_identity().
+        """
+        try:
+            tmp_path = f"{self.identity_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as handle:
+                json.dump({"fingerprint": fingerprint, "username": username, "validated_at": time()}, handle)
+            os.replace(tmp_path, self.identity_path)
+        except Exception:  # pylint: disable=broad-exception-caught
+            pass
+
+    def _clear_identity(self):
+        """
+        Forget the validated identity, so the credentials are checked on the next login.
+        """
+        if os.path.isfile(self.identity_path):
+            os.remove(self.identity_path)
+
+    def _revalidate_identity(self, api, fingerprint: str):
+        """
+        Validate cached credentials with RXN, runs in the background.
+
+        Valid credentials are cached for another TTL. Rejected ones are forgotten,
+        and the next command warns about them. Network errors are ignored.
+        """
+        try:
+            response = api.current_user().get("response", {}) or {}
+        except Exception:  # pylint: disable=broad-exception-caught
+            return
+        username = response.get("payload", {}).get("email") if response else None
+        if username:
+            self._store_identity(fingerprint, username)
+        elif response.get("status") == 401:
+            self._clear_identity()
+            _revoked_fingerprints.add(fingerprint)
+
+    def _get_client(self):
+        """
+        Return the RXN client stored in the login settings, if any.
+        """
+        if PLUGIN_KEY not in self.cmd_pointer.login_settings["toolkits"]:
+            return None
+        toolkit_index = self.cmd_pointer.login_settings["toolkits"].index(PLUGIN_KEY)
+        return self.cmd_pointer.login_settings["client"][toolkit_index]
+
+    def _update_login_session(self):
+        """
+        Remember the validated login for the next commands, see LoginSession.
+
+        Logins without the workspace's own project are not remembered, eg. while it's
+        still being created in the background, so the project sync is tried again.
+        """
+        workspace = self.cmd_pointer.settings["workspace"]
+        name, project_id = self.get_current_project()
+        if not project_id or name != workspace.upper():
+            return
+        bootstrap = _project_bootstraps.get(workspace.upper())
+        if bootstrap and not bootstrap.done():
+            return
+        login_session.update(self._get_client(), workspace, project_id, self.cred_path)
+
     def _apikey_stored(self):
         if not PLUGIN_KEY in self.cmd_pointer.login_settings["toolkits"]:
             return False
@@ -194,6 +544,8 @@ class RXNLoginManager:
         """
         Remove login credentials to trigger authentication reset.
         """
+        login_session.reset()
+        self._clear_identity()
         if os.path.isfile(self.cred_path):
             os.remove(self.cred_path)
             output_success("You are logged out from RXN", return_val=False)
@@ -209,7 +561,10 @@ class RXNLoginManager:
     def _sync_workspace_rxn_project(self, reset=False):
         """
         Create or reuse an RXN project with the same name as your workspace, required to use the API.
+
+        New projects are created in the background, see wait_for_project().
         """
+        self.api = self.api or self._get_client()
 
         # Check if you already have a project set up for this workspace,
         # and initialize the API wih it
@@ -224,82 +579,91 @@ class RXNLoginManager:
         if name == self.cmd_pointer.settings["workspace"] and not reset:
             return
 
-        # Create new project
-        success = False
+        # A project for this workspace is already being created
+        bootstrap = _project_bootstraps.get(workspace_name)
+        if bootstrap and not bootstrap.done():
+            return
+
+        # Create new project in the background, see wait_for_project()
+        workspace = self.cmd_pointer.settings["workspace"]
+        _project_bootstraps[workspace_name] = ProjectBootstrap(lambda: self._create_workspace_rxn_project(workspace))
+
+    def _create_workspace_rxn_project(self, workspace: str):
+        """
+        Create an RXN project for a workspace and make it the current project.
+
+        Runs in the background, returns the project id or raises an exception on failure.
+        """
+        retry_policy = RetryPolicy(budget=4)
         retries = 0
-        while retries < 5 and success is False:
-            if retries > 1:
-                sleep(3)
+        while retries == 0 or retry_policy.retry(retries):
             retries += 1
 
-            try:
-                result = self.api.create_project(self.cmd_pointer.settings["workspace"])
+            result = self.api.create_project(workspace)
+            if len(result) == 0 or retry_policy.throttled():
+                continue
+            self.__append_project(workspace.upper(), result["response"]["payload"]["id"])
 
-                if len(result) == 0:
-                    continue
-                else:
-                    self.__append_project(
-                        self.cmd_pointer.settings["workspace"].upper(),
-                        result["response"]["payload"]["id"],
-                    )
-            except Exception as err:  # pylint: disable=broad-exception-caught
-                output_error(["Unable to create RXN project", "API may be offline", err], return_val=False)
-                return
+            sleep(3)
+            if self.__set_current_project(workspace.upper()):
+                return self.___get_project_id(workspace.upper())
 
-            try:
-                sleep(3)
-                success = self.__set_current_project(self.cmd_pointer.settings["workspace"].upper())
-            except Exception as err:  # pylint: disable=broad-exception-caught
-                output_error(["Unable to set RXN project", "API may be offline", err], return_val=False)
-                return
+        raise RuntimeError(f"Failed to create a project after {retries} attempts")
+
+    def wait_for_project(self) -> bool:
+        """
+        Wait until the RXN project of the workspace is set up,
+        in case it's still being created in the background.
+
+        Returns False when the project couldn't be created.
+        """
+        workspace_name = self.cmd_pointer.settings["workspace"].upper()
+        bootstrap = _project_bootstraps.get(workspace_name)
+        if bootstrap is None or bootstrap.reported:
+            return True
+
+        waiting_since = time()
+        if not bootstrap.done():
+            spinner.start("Setting up an RXN project for this workspace")
+        try:
+            bootstrap.future.result()
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            spinner.stop()
+            _project_bootstraps.pop(workspace_name, None)
+            login_session.reset()
+            output_error(
+                ["Unable to set up an RXN project for this workspace", "API may be offline", err], return_val=False
+            )
+            return False
+        spinner.stop()
 
         # Success
-        output_text("<soft>A new RXN project has been setup for this workspace</soft>", return_val=False)
-        return
+        bootstrap.reported = True
+        output_text(
+            f"<soft>A new RXN project has been setup for this workspace in {round(bootstrap.duration(), 1)}s, "
+            f"of which {round(time() - waiting_since, 1)}s spent waiting</soft>",
+            return_val=False,
+        )
+        self._update_login_session()
+        return True
 
     def __get_all_projects(self):
         """
         Get list of all your RXN projects.
         """
-        try:
-            with open(self.cmd_pointer.home_dir + "/RXN_Projects/rxn_projects.pkl", "r", encoding="utf-8") as handle:
-                projects = json.loads(handle.read())
-                handle.close()
-        except Exception:  # pylint: disable=broad-exception-caught
-            projects = {}
-
-        return projects
+        return self.__get_project_registry().all()
 
     def __append_project(self, project_name, project_id):
         """
         Append newly created project to the list of projects.
         """
-        if not os.path.isdir(self.cmd_pointer.home_dir + "/RXN_Projects/"):
-            os.mkdir(self.cmd_pointer.home_dir + "/RXN_Projects/")
+        return self.__get_project_registry().add(project_name, project_id)
 
-        try:
-            with open(self.cmd_pointer.home_dir + "/RXN_Projects/rxn_projects.pkl", "r", encoding="utf-8") as handle:
-                projects = json.loads(handle.read())
-                handle.close()
-        except Exception:  # pylint: disable=broad-exception-caught
-            projects = {}
-        projects[project_name] = project_id
-
-        try:
-            with open(self.cmd_pointer.home_dir + "/RXN_Projects/rxn_projects.pkl", "w", encoding="utf-8") as handle:
-                json.dump(dict(projects), handle)
-                handle.close()
-        except Exception:  # pylint: disable=broad-exception-caught
-            return False
-
-        shutil.copyfile(
-            self.cmd_pointer.home_dir + "/RXN_Projects/rxn_projects.pkl",
-            self.cmd_pointer.home_dir
-            + "/RXN_Projects/rxn_projects_"
-            + datetime.now().strftime("%Y-%m-%d_%H%M%S")
-            + ".bup",
-        )
-        return True
+    def __get_project_registry(self) -> ProjectRegistry:
+        """
+        Get the registry of RXN projects per workspace.
+        """
+        return get_project_registry(os.path.join(self.cmd_pointer.home_dir, "RXN_Projects"))
 
     def __set_current_project(self, project_name: str) -> bool:
         """
@@ -319,16 +683,7 @@ class RXNLoginManager:
                 return False
 
     def ___get_project_id(self, project_name):
-        project_id = False
-        try:
-            with open(self.cmd_pointer.home_dir + "/RXN_Projects/rxn_projects.pkl", "r", encoding="utf-8") as handle:
-                projects = json.loads(handle.read())
-                handle.close()
-                project_id = projects[project_name]
-        except Exception:  # pylint: disable=broad-exception-caught
-            pass
-
-        return project_id
+        return self.__get_project_registry().get(project_name)
 
     def get_current_project(self):
         """
@@ -367,14 +722,13 @@ class RXNLoginManager:
         """
         result = False
         retries = 0
+        retry_policy = RetryPolicy(budget=10)
         while result is False:
             try:
                 result = self.api.list_all_projects(size=100)["response"]["payload"]["content"]
             except Exception as err:  # pylint: disable=broad-except
-                if retries < 10:
-                    sleep(2)
-                    retries += 1
-                else:
+                retries += 1
+                if not retry_policy.retry(retries):
                     output_error(["Unable to retrieve list of projects", err], return_val=False)
                     return
 
@@ -1,19 +1,24 @@
 import os
-import pickle
+import atexit
 import pandas as pd
+from functools import lru_cache
+from rdkit import Chem, rdBase
 from rdkit.Chem import AllChem
 from rdkit.Chem.Draw import rdMolDraw2D
 
 # OpenAD
 from openad.app.global_var_lib import GLOBAL_SETTINGS
+from openad.smols.smol_cache import save_result
 
 # OpenAD tools
 from openad_tools.pyparsing import parse_using_clause
-from openad_tools.output import output_text, output_error, output_success
+from openad_tools.output import output_error, output_success
 
 # Plugin
 from openad_plugin_rxn.plugin_msg import msg
 from openad_plugin_rxn.plugin_login import RXNLoginManager
+from openad_plugin_rxn.plugin_cache import RXNCache, WriteBehindQueue, get_cache
+from openad_plugin_rxn.plugin_retry import RetryPolicy
 from openad_plugin_rxn.plugin_params import PLUGIN_KEY
 
 spinner_msg = [
@@ -29,14 +34,60 @@ spinner_msg = [
 ]
 
 
+@lru_cache(maxsize=100_000)
+def canonicalize_smiles(smiles: str) -> str | None:
+    """
+    Return the RDKit-canonical version of a SMILES string, or None if it's invalid.
+
+    Memoized for the whole process, because the same reagents
+    and solvents recur across thousands of reactions.
+    """
+    if not smiles or not isinstance(smiles, str):
+        return None
+    with rdBase.BlockLogs():
+        mol = Chem.MolFromSmiles(smiles)  # pylint: disable=no-member
+    if mol is None:
+        return None
+    return Chem.MolToSmiles(mol)  # pylint: disable=no-member
+
+
+def _save_analysis_records(items: list):
+    """
+    Save a batch of queued analysis records, see RXNPlugin.save_analysis_record().
+    """
+    errors = []
+    for record, cmd_pointer in items:
+        try:
+            save_result(record, cmd_pointer)
+        except Exception as err:  # pylint: disable=broad-except
+            errors.append(err)
+    if errors:
+        raise errors[0]
+
+
+# Analysis records are saved in the background, like cache writes
+analysis_writer = WriteBehindQueue(
+    _save_analysis_records,
+    RXNCache.WRITE_FLUSH_SIZE,
+    RXNCache.WRITE_FLUSH_DELAY,
+    name="rxn-analysis-records",
+)
+atexit.register(analysis_writer.flush)
+
+
 class RXNPlugin:
     cmd_pointer = None
     login_manager = None
     api = None
+    cache_dir = None
+    retry_policy = None
 
     def __init__(self, cmd_pointer):
         self.cmd_pointer = cmd_pointer
 
+        # Retry budget shared by all API calls of the command
+        self.retry_policy = RetryPolicy()
+
         # Login
         self.login_manager = RXNLoginManager(cmd_pointer)
         self.login_manager.login()
@@ -44,6 +95,15 @@ class RXNPlugin:
         # Define the RXN API
         self._init_api()
 
+    def wait_for_project(self) -> bool:
+        """
+        Wait for the RXN project of the workspace, which is required to submit jobs.
+
+        New projects are set up in the background during login,
+        so only the job submission has to wait for them.
+        """
+        return self.login_manager.wait_for_project()
+
     def _init_api(self):
         if not self.api:
             self.api = self.cmd_pointer.login_settings["client"][
@@ -385,62 +445,234 @@ class RXNPlugin:
 
         return output
 
-    def homogenize_smiles(self, smiles_list: list) -> str:
+    def homogenize_smiles(self, smiles_list: list, canonical: bool = True) -> str:
         """
-        Sort and join a list of smiles so it can be compared.
+        Canonicalize, sort and join a list of smiles so it can be compared.
+
+        OCC.BrBr and BrBr.C(O)C both become BrBr.CCO
+
+        Parameters
+        ----------
+        smiles_list : list
+            List of SMILES strings.
+        canonical : bool
+            Canonicalize every SMILES with RDKit before sorting.
+            Invalid SMILES are kept as they are.
         """
-        smiles_list.sort()
-        return ".".join(smiles_list)
+        if canonical:
+            smiles_list = [canonicalize_smiles(smiles) or smiles for smiles in smiles_list]
+        return ".".join(sorted(smiles_list))
 
     # Caching
     # -------
 
-    def store_result_cache(self, name, key, payload) -> bool:
+    def store_result_cache(self, name, key, payload, aliases=None) -> bool:
         """
         Save a result to the cache.
 
-        /<workspace>/._openad/rxn_cache/rxn-<func_name>-<model_name>--<input_smiles>.result
-        /<workspace>/._openad/rxn_cache/rxn-<func_name>-<model_name>-topn-<int>--<input_smiles>.result
+        The payload is stored once, any aliases are extra keys pointing to it.
+
+        See RXNCache for details on how results are stored.
+        - name: predict-reaction-<model_name>
+        - name: predict-reaction-<model_name>-topn-<int>
+        - name: predict-retro-<model_name>-params-<params_digest>
+        - key: <input_smiles>
         """
         try:
-            filename = f"rxn-{name}--{key}.result"
-            if len(filename) > 256:
-                output_text("<soft>Result not cached, too complex</soft>")
-                return
-            cache_dir = self._get_cache_dir()
-            with open(os.path.join(cache_dir, filename), "wb") as handle:
-                pickle.dump({"payload": payload}, handle)
-            return True
+            return self._get_cache().store(name, key, payload, aliases)
         except Exception as err:  # pylint: disable=broad-except
             output_error(["Failed to save result as cache", f"Data: {payload}", err], return_val=False)
             return False
 
+    def store_result_cache_many(self, name, payloads: dict) -> bool:
+        """
+        Save a batch of key -> payload results to the cache in one go.
+        """
+        try:
+            return self._get_cache().store_many(name, payloads)
+        except Exception as err:  # pylint: disable=broad-except
+            output_error(["Failed to save results as cache", err], return_val=False)
+            return False
+
     def retrieve_result_cache(self, name, key):
         """
         Retrieve result from the cache.
         """
         try:
-            filename = f"rxn-{name}--{key}.result"
-            cache_dir = self._get_cache_dir()
-            with open(os.path.join(cache_dir, filename), "rb") as handle:
-                result = pickle.load(handle)
-            return result.get("payload")
+            return self._get_cache().retrieve(name, key) or False
         except Exception:  # pylint: disable=broad-except
             return False
 
-    def clear_cache(self):
+    def retrieve_result_cache_many(self, name, keys) -> dict:
+        """
+        Retrieve a batch of results from the cache in one go.
+
+        Returns a key -> payload dictionary with only the keys that were found.
+        """
+        try:
+            return self._get_cache().retrieve_many(name, keys)
+        except Exception:  # pylint: disable=broad-except
+            return {}
+
+    def retrieve_result_cache_variants(self, name_prefix, keys) -> dict:
+        """
+        Retrieve a batch of results from every cache name starting with name_prefix.
+
+        Returns a key -> {name: payload} dictionary with only the keys that were found.
+        """
+        try:
+            return self._get_cache().retrieve_variants(name_prefix, keys)
+        except Exception:  # pylint: disable=broad-except
+            return {}
+
+    def save_analysis_record(self, record: dict):
+        """
+        Queue an analysis record to be saved in the background, so it can be
+        merged with the molecule working set with `enrich mols with analysis`.
+        """
+        analysis_writer.put((record, self.cmd_pointer))
+
+    def flush_writes(self, wait: bool = False):
+        """
+        Start writing the queued cache results and analysis records, called when a command is done.
+
+        Errors from earlier writes are reported here, as they happen in the background.
+        """
+        try:
+            cache = self._get_cache()
+            cache.flush_writes(wait)
+            cache_errors = cache.writer.pop_errors()
+        except Exception as err:  # pylint: disable=broad-except
+            cache_errors = [err]
+        analysis_writer.flush(wait)
+        analysis_errors = analysis_writer.pop_errors()
+
+        if cache_errors:
+            output_error(["Failed to save results as cache", cache_errors[0]], return_val=False)
+        if analysis_errors:
+            output_error(["Failed to save analysis records", analysis_errors[0]], return_val=False)
+
+    def record_cache_lookups(self, name, hits: int, misses: int):
+        """
+        Count cache hits and misses, displayed by `rxn cache stats`.
+        """
+        try:
+            self._get_cache().record_lookups(name, hits, misses)
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    def get_job_durations(self, kind: str, params: str) -> list:
+        """
+        Get how long similar RXN jobs took before, in seconds.
+        """
+        try:
+            return self._get_cache().job_durations(kind, params)
+        except Exception:  # pylint: disable=broad-except
+            return []
+
+    def record_job_duration(self, kind: str, params: str, duration: float):
+        """
+        Remember how long an RXN job took, to time the status checks of similar jobs.
+        """
+        try:
+            self._get_cache().record_job_duration(kind, params, duration)
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    def clear_cache(self, filters: dict = None):
+        """
+        Clear the cache, or only the results matching the filters.
+
+        Parameters
+        ----------
+        filters : dict, optional
+            Any of: function, ai_model, older_than_days, smiles
+            See RXNCache.clear() for details.
+        """
+        filters = {key: val for key, val in (filters or {}).items() if val is not None}
+        if "older_than_days" in filters:
+            try:
+                filters["older_than_days"] = float(filters["older_than_days"])
+            except (TypeError, ValueError):
+                output_error("Parameter older_than_days should be a number", return_val=False)
+                return
+        if not filters:
+            self._get_cache().clear()
+            output_success("All cache files cleared", return_val=False)
+            return
+
+        count = self._get_cache().clear(
+            function=filters.get("function"),
+            ai_model=filters.get("ai_model"),
+            older_than_days=filters.get("older_than_days"),
+            smiles_pattern=filters.get("smiles"),
+        )
+        output_success(f"Cleared {count} cached results", return_val=False)
+
+    def compact_cache(self):
+        """
+        Evict entries over the cache's size and age limits, then reclaim the freed disk space.
+        """
+        result = self._get_cache().compact()
+        size_before = round(result["size_before"] / 1024 / 1024, 2)
+        size_after = round(result["size_after"] / 1024 / 1024, 2)
+        output_success(
+            [
+                "Cache compacted",
+                f"Evicted entries: {result['evicted']}",
+                f"Cache size: {size_before} MB -> {size_after} MB",
+            ],
+            return_val=False,
+        )
+
+    def export_cache(self, filename: str):
+        """
+        Export the cache to a bundle file that can be imported in another workspace.
+        """
+        file_path = os.path.join(self.cmd_pointer.workspace_path(), filename)
+        try:
+            count = self._get_cache().export_bundle(file_path)
+        except Exception as err:  # pylint: disable=broad-except
+            output_error(["Failed to export cache", f"Path: {filename}", err], return_val=False)
+            return
+        output_success([f"Exported {count} cached results", f"Path: {filename}"], return_val=False)
+
+    def import_cache(self, filename: str):
+        """
+        Merge a bundle file created by export_cache() into the cache.
+        """
+        file_path = os.path.join(self.cmd_pointer.workspace_path(), filename)
+        try:
+            result = self._get_cache().import_bundle(file_path)
+        except FileNotFoundError as err:
+            output_error(
+                ["File not found", "Path should be relative to your workspace", f"Path: {filename}", err],
+                return_val=False,
+            )
+            return
+        except Exception as err:  # pylint: disable=broad-except
+            output_error(["Failed to import cache", f"Path: {filename}", err], return_val=False)
+            return
+        output_success(
+            [
+                f"Imported {result['imported']} cached results",
+                f"Skipped {result['skipped']} results that are already cached with a newer version",
+            ],
+            return_val=False,
+        )
+
+    def _get_cache(self) -> RXNCache:
         """
-        Clear the cache directory.
+        Get the cache for the current workspace.
         """
-        cache_dir = self._get_cache_dir()
-        for file in os.listdir(cache_dir):
-            os.remove(os.path.join(cache_dir, file))
-        output_success("All cache files cleared", return_val=False)
+        return get_cache(self._get_cache_dir())
 
     def _get_cache_dir(self):
         """
         Get the cache directory, create if it doesn't exist yet.
         """
         cache_dir = os.path.join(self.cmd_pointer.workspace_path(), "._openad", "rxn_cache")
-        os.makedirs(cache_dir, exist_ok=True)
+        if cache_dir != self.cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.cache_dir = cache_dir
         return cache_dir
@@ -18,5 +18,75 @@ PLUGIN_NAMESPACE = plugin_metadata.get("namespace")
 CLAUSES = {
     "save_as": "<cmd>save as</cmd>\n    Save the results as a csv file in your current workspace.",
     "use_cache": "<cmd>use cache</cmd>\n    Use cached results when available.",
+    "use_legacy_cache": "<cmd>use legacy cache</cmd>\n    Use cached results when available, including results cached by older versions of the plugin, which were stored without their parameters. Legacy results may have been generated with different parameters.",
     "rich_output": "<cmd>rich</cmd>\n    Display rich output. This will make your results easier to understand but will take up more vertical space.",
 }
+
+# Cache settings, can be overridden with environment variables
+CACHE_SETTINGS = {
+    # How long to wait for another kernel or process that is writing to the same cache
+    "busy_timeout_seconds": float(os.environ.get("RXN_CACHE_BUSY_TIMEOUT_SECONDS", 30)),
+    # Number of RXN jobs submitted in parallel by rxn cache warm, and reactions per job
+    "warm_concurrency": int(os.environ.get("RXN_CACHE_WARM_CONCURRENCY", 4)),
+    "warm_batch_size": int(os.environ.get("RXN_CACHE_WARM_BATCH_SIZE", 50)),
+    # In-memory LRU tier shared by all commands in the process
+    "memory_max_entries": int(os.environ.get("RXN_MEMORY_CACHE_MAX_ENTRIES", 2000)),
+    "memory_max_bytes": int(float(os.environ.get("RXN_MEMORY_CACHE_MAX_MB", 64)) * 1024 * 1024),
+    # Disk budget per namespace, the least recently used entries are evicted first
+    # A max age or budget of 0 means no limit
+    "namespaces": {
+        "predict-reaction": {
+            "max_bytes": int(float(os.environ.get("RXN_CACHE_MAX_MB_PREDICT_REACTION", 256)) * 1024 * 1024),
+            "max_age_days": float(os.environ.get("RXN_CACHE_MAX_AGE_DAYS_PREDICT_REACTION", 180)),
+        },
+        "predict-retro": {
+            "max_bytes": int(float(os.environ.get("RXN_CACHE_MAX_MB_PREDICT_RETRO", 512)) * 1024 * 1024),
+            "max_age_days": float(os.environ.get("RXN_CACHE_MAX_AGE_DAYS_PREDICT_RETRO", 365)),
+        },
+        # Sub-routes of retrosynthesis results, indexed by intermediate
+        "retro-subroutes": {
+            "max_bytes": int(float(os.environ.get("RXN_CACHE_MAX_MB_RETRO_SUBROUTES", 128)) * 1024 * 1024),
+            "max_age_days": float(os.environ.get("RXN_CACHE_MAX_AGE_DAYS_RETRO_SUBROUTES", 365)),
+        },
+        # Negative cache: invalid SMILES and inputs rejected by RXN, which expire
+        # after a fixed number of days (TTL) no matter how often they're used
+        "rejected": {
+            "max_bytes": int(float(os.environ.get("RXN_CACHE_MAX_MB_REJECTED", 16)) * 1024 * 1024),
+            "ttl_days": float(os.environ.get("RXN_CACHE_TTL_DAYS_REJECTED", 30)),
+        },
+    },
+}
+
+# HTTP settings, can be overridden with environment variables
+HTTP_SETTINGS = {
+    # Number of keep-alive connections kept open to the RXN server, should be at least RXN_CACHE_WARM_CONCURRENCY
+    "pool_size": int(os.environ.get("RXN_HTTP_POOL_SIZE", 10)),
+}
+
+# Login settings, can be overridden with environment variables
+LOGIN_SETTINGS = {
+    # Seconds a validated login is reused by later commands before it's checked again
+    "session_ttl_seconds": float(os.environ.get("RXN_SESSION_TTL_SECONDS", 900)),
+    # Seconds a validated API key is trusted on startup, it's checked again in the background
+    "identity_ttl_seconds": float(os.environ.get("RXN_IDENTITY_TTL_SECONDS", 24 * 60 * 60)),
+}
+
+# Retry settings, can be overridden with environment variables
+RETRY_SETTINGS = {
+    # Retries wait a random time between 0 and base * 2^attempt seconds, up to the cap
+    "base_seconds": float(os.environ.get("RXN_RETRY_BASE_SECONDS", 1)),
+    "cap_seconds": float(os.environ.get("RXN_RETRY_CAP_SECONDS", 30)),
+    # Maximum number of retries per command, across all API calls
+    "budget": int(os.environ.get("RXN_RETRY_BUDGET", 20)),
+    # Longest Retry-After from the server that is honored
+    "max_retry_after_seconds": float(os.environ.get("RXN_RETRY_MAX_RETRY_AFTER_SECONDS", 300)),
+}
+
+# Retrosynthesis polling settings, can be overridden with environment variables
+RETRO_POLL_SETTINGS = {
+    # Shortest and longest wait between two checks on a retrosynthesis job
+    "min_interval_seconds": float(os.environ.get("RXN_RETRO_POLL_MIN_SECONDS", 2)),
+    "max_interval_seconds": float(os.environ.get("RXN_RETRO_POLL_MAX_SECONDS", 15)),
+    # Give up on a job after this many seconds, or twice the longest similar job if that took longer
+    "deadline_seconds": float(os.environ.get("RXN_RETRO_DEADLINE_SECONDS", 30 * 60)),
+}
@@ -0,0 +1,183 @@
+import time
+import random
+import threading
+
+# Plugin
+from openad_plugin_rxn.plugin_params import RETRY_SETTINGS, RETRO_POLL_SETTINGS
+from openad_plugin_rxn.plugin_http import get_throttle_status, pop_retry_after
+
+
+def _retry_after() -> float:
+    """
+    Return the Retry-After of the last throttled call in this thread, or 0.
+    """
+    retry_after = pop_retry_after()
+    if retry_after is None:
+        return 0
+    return min(retry_after, RETRY_SETTINGS["max_retry_after_seconds"])
+
+
+class RetryPolicy:
+    """
+    Shared timing for every loop that retries or polls the RXN API.
+
+    Retries wait a random time between 0 and base * 2^attempt seconds, capped
+    (capped exponential backoff with full jitter), so clients that failed at the
+    same moment don't retry in lockstep. When the server throttled the last call
+    with a Retry-After header (HTTP 429 or 503), the jitter is added on top of it.
+
+    Every retry draws from a budget shared by all API calls of a command, so a
+    struggling server isn't retried indefinitely. Polling a running job doesn't
+    count against the budget.
+
+    Thread-safe, so worker threads can share a command's policy.
+    """
+
+    def __init__(self, base_seconds: float = None, cap_seconds: float = None, budget: int = None):
+        """
+        Parameters
+        ----------
+        base_seconds: float
+            Upper bound of the first retry's delay, defaults to RETRY_SETTINGS.
+        cap_seconds: float
+            Maximum delay between two retries, defaults to RETRY_SETTINGS.
+        budget: int
+            Maximum number of retries, defaults to RETRY_SETTINGS.
+        """
+        self.base_seconds = RETRY_SETTINGS["base_seconds"] if base_seconds is None else base_seconds
+        self.cap_seconds = RETRY_SETTINGS["cap_seconds"] if cap_seconds is None else cap_seconds
+        self.budget = RETRY_SETTINGS["budget"] if budget is None else budget
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def retry(self, attempt: int) -> bool:
+        """
+        Wait before retrying a failed call.
+
+        Returns False without waiting when the retry budget is spent, the caller should give up.
+
+        Parameters
+        ----------
+        attempt: int
+            Number of attempts that failed so far, starting at 1.
+        """
+        with self.lock:
+            if self.retries >= self.budget:
+                return False
+            self.retries += 1
+        time.sleep(self.delay(attempt))
+        return True
+
+    def call(self, function, *args, **kwargs):
+        """
+        Call an API function, and call it again while the server throttles it, within the retry budget.
+
+        Other failures are left to the caller, the last response is returned as is.
+        """
+        attempt = 0
+        while True:
+            result = function(*args, **kwargs)
+            attempt += 1
+            if not self.throttled() or not self.retry(attempt):
+                return result
+
+    def delay(self, attempt: int) -> float:
+        """
+        Return the number of seconds to wait before retrying, see retry().
+        """
+        upper = min(self.cap_seconds, self.base_seconds * 2 ** max(0, attempt - 1))
+        return _retry_after() + random.uniform(0, upper)
+
+    def poll_delay(self, attempt: int, base_seconds: float, cap_seconds: float) -> float:
+        """
+        Return the number of seconds to wait before checking on a running job again.
+
+        The interval grows from base_seconds up to cap_seconds, with jitter,
+        so jobs submitted together don't poll the server in lockstep.
+
+        Parameters
+        ----------
+        attempt: int
+            Number of checks done so far, starting at 1.
+        """
+        upper = min(cap_seconds, base_seconds * 2 ** max(0, attempt - 1))
+        return _retry_after() + random.uniform(base_seconds, max(base_seconds, upper))
+
+    def throttled(self) -> bool:
+        """
+        Return True if the server throttled the last call of this thread (HTTP 429 or 503).
+        """
+        return get_throttle_status() is not None
+
+
+class AdaptivePoller:
+    """
+    Timing of the status checks on a long-running job, eg. a retrosynthesis.
+
+    Checks start every min_seconds and slow down as the job runs longer,
+    waiting BACKOFF_FRACTION of the time elapsed so far, so a result is
+    picked up at most ~10% later than it was ready, up to max_seconds.
+
+    When similar jobs ran before, checks don't start before the quickest
+    of them would have been done (the EARLIEST_QUANTILE of their durations),
+    and the deadline is extended to twice the longest of them, so jobs that
+    are known to be slow don't time out.
+    """
+
+    BACKOFF_FRACTION = 0.1
+    EARLIEST_QUANTILE = 0.1
+    JITTER = 0.1
+
+    def __init__(
+        self,
+        history: list = None,
+        started: float = None,
+        min_seconds: float = None,
+        max_seconds: float = None,
+        deadline_seconds: float = None,
+    ):
+        """
+        Parameters
+        ----------
+        history: list
+            Durations of similar jobs in seconds, see RXNCache.job_durations().
+        started: float
+            When the job was submitted, defaults to now.
+        min_seconds, max_seconds, deadline_seconds: float
+            Shortest and longest wait between two checks, and when to give up. Default to RETRO_POLL_SETTINGS.
+        """
+        self.history = sorted(history or [])
+        self.started = time.time() if started is None else started
+        self.min_seconds = RETRO_POLL_SETTINGS["min_interval_seconds"] if min_seconds is None else min_seconds
+        self.max_seconds = RETRO_POLL_SETTINGS["max_interval_seconds"] if max_seconds is None else max_seconds
+        self.deadline_seconds = (
+            RETRO_POLL_SETTINGS["deadline_seconds"] if deadline_seconds is None else deadline_seconds
+        )
+        if self.history:
+            self.deadline_seconds = max(self.deadline_seconds, 2 * self.history[-1])
+
+    def elapsed(self) -> float:
+        """
+        Return the number of seconds since the job was submitted.
+        """
+        return time.time() - self.started
+
+    def expired(self) -> bool:
+        """
+        Return True when the deadline has passed.
+        """
+        return self.elapsed() >= self.deadline_seconds
+
+    def next_delay(self) -> float:
+        """
+        Return the number of seconds to wait before the next check.
+
+        A Retry-After from the server is added on top, see RetryPolicy.
+        """
+        elapsed = self.elapsed()
+        delay = max(self.min_seconds, elapsed * self.BACKOFF_FRACTION)
+        if self.history:
+            earliest = self.history[int(len(self.history) * self.EARLIEST_QUANTILE)]
+            delay = max(delay, earliest - elapsed)
+        delay = min(delay, self.max_seconds, max(0, self.deadline_seconds - elapsed))
+        return _retry_after() + delay * random.uniform(1 - self.JITTER, 1 + self.JITTER)